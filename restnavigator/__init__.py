@@ -1,2 +1,3 @@
 from .halnav import HALNavigator
-from .traverser import HALTraversor
\ No newline at end of file
+from .traverser import HALTraversor
+from .crawler import crawl
@@ -0,0 +1,150 @@
+"""Cache stores for HALNavigator's `cache` option"""
+
+from __future__ import print_function
+
+import contextlib
+import sqlite3
+import threading
+import time
+
+import cachecontrol
+from cachecontrol.cache import BaseCache
+
+
+# 100 MiB
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024
+# Seconds. How stale the last use time of a response may get before a read
+# updates it, so reads are rarely writes
+DEFAULT_TOUCH_INTERVAL = 60
+
+
+class SQLiteCache(BaseCache):
+    """A CacheControl cache store kept in an SQLite database file.
+
+    Unlike the default in-memory store, it survives restarts, and several
+    processes on the same host can safely share it. The total size of the
+    cached responses is kept under `max_bytes` by evicting the least
+    recently used ones.
+
+    `timeout` is how many seconds to wait for another process to release
+    the database before giving up. Reading a response only records when it
+    was used if that's more than `touch_interval` seconds out of date, so
+    most reads don't write to the database."""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, timeout=30,
+                 touch_interval=DEFAULT_TOUCH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.touch_interval = touch_interval
+        # sqlite3 connections can't be shared between threads
+        self._local = threading.local()
+        db = self._connection()
+        # WAL lets readers carry on while another process writes
+        db.execute('PRAGMA journal_mode=WAL')
+        with self._transaction() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                       ' key TEXT PRIMARY KEY,'
+                       ' value BLOB NOT NULL,'
+                       ' size INTEGER NOT NULL,'
+                       ' used REAL NOT NULL)')
+            db.execute('CREATE INDEX IF NOT EXISTS responses_used'
+                       ' ON responses (used)')
+            # The total size is kept up to date by triggers, so every
+            # process sees it without summing the whole table
+            db.execute('CREATE TABLE IF NOT EXISTS totals ('
+                       ' id INTEGER PRIMARY KEY CHECK (id = 0),'
+                       ' size INTEGER NOT NULL)')
+            db.execute('INSERT OR IGNORE INTO totals (id, size)'
+                       ' SELECT 0, COALESCE(SUM(size), 0) FROM responses')
+            db.execute('CREATE TRIGGER IF NOT EXISTS responses_insert'
+                       ' AFTER INSERT ON responses BEGIN'
+                       ' UPDATE totals SET size = size + NEW.size; END')
+            db.execute('CREATE TRIGGER IF NOT EXISTS responses_delete'
+                       ' AFTER DELETE ON responses BEGIN'
+                       ' UPDATE totals SET size = size - OLD.size; END')
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None)
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        else:
+            db.execute('COMMIT')
+
+    def get(self, key):
+        db = self._connection()
+        row = db.execute('SELECT value, used FROM responses WHERE key = ?',
+                         (key,)).fetchone()
+        if row is None:
+            return None
+        value, used = row
+        now = time.time()
+        if now - used > self.touch_interval:
+            db.execute('UPDATE responses SET used = ? WHERE key = ?',
+                       (now, key))
+        return bytes(value)
+
+    def set(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            self.delete(key)
+            return
+        with self._transaction() as db:
+            # not INSERT OR REPLACE, the rows it replaces don't fire the
+            # delete trigger
+            db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            db.execute('INSERT INTO responses (key, value, size, used)'
+                       ' VALUES (?, ?, ?, ?)',
+                       (key, sqlite3.Binary(value), size, time.time()))
+            total, = db.execute('SELECT size FROM totals').fetchone()
+            excess = total - self.max_bytes
+            if excess <= 0:
+                return
+            evicted = []
+            for old_key, old_size in db.execute(
+                    'SELECT key, size FROM responses WHERE key != ?'
+                    ' ORDER BY used', (key,)):
+                evicted.append((old_key,))
+                excess -= old_size
+                if excess <= 0:
+                    break
+            db.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM responses WHERE key = ?',
+                                   (key,))
+
+    def close(self):
+        """Closes this thread's connection to the database"""
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+class CacheAdapter(cachecontrol.CacheControlAdapter):
+    """A CacheControlAdapter that marks the responses it serves after the
+    server confirmed them with a 304 with `revalidated = True`, so they can
+    be told apart from ones served without contacting the server (both have
+    `from_cache` set). HALNavigator uses it for the adapters it creates."""
+
+    def build_response(self, request, response, from_cache=False):
+        resp = super(CacheAdapter, self).build_response(
+            request, response, from_cache=from_cache)
+        # from_cache only goes from False to True on the way through when
+        # a 304 from the server was answered with the cached response
+        resp.revalidated = resp.from_cache and not from_cache
+        return resp
@@ -0,0 +1,97 @@
+from __future__ import print_function
+
+import collections
+import Queue
+
+import requests
+
+from restnavigator.exc import UnexpectedlyNotJSON
+from restnavigator.halnav import HALNavigator
+
+
+def crawl(root,
+          max_depth=None,
+          max_requests=None,
+          rel_filter=None,
+          workers=10,
+          template_args=None):
+    """Walks the link graph of an api breadth first, yielding every
+    navigator it reaches as soon as it's been fetched.
+
+    `root` is a HALNavigator or the uri of the api root
+    `max_depth` is how many links away from the root to go (unlimited by
+        default)
+    `max_requests` stops the crawl after that many requests
+    `rel_filter` limits the rels that are followed: a list of rels, or a
+        function that's given a rel and returns whether to follow it
+    `workers` is the most requests made concurrently. They run on the
+        api's worker pool, so there are never more than its max_workers
+    `template_args` are used to expand templated links. Templated links
+        with parameters not in it are skipped
+
+    Each resource is only visited once, resources that were already fetched
+    are yielded without a request. If fetching a resource fails with an
+    error status it's still yielded (check its .status), if it fails
+    entirely its state is None and its links aren't followed."""
+    if not isinstance(root, HALNavigator):
+        root = HALNavigator(root, max_workers=workers)
+    if isinstance(rel_filter, basestring):
+        rel_filter = [rel_filter]
+    api = root._api
+    done = Queue.Queue()
+    queued = collections.deque([(root, 0)])
+    seen = set([root.uri])
+    in_flight = 0
+    requests_made = 0
+
+    def fetch(nav, depth):
+        try:
+            nav.get(raise_exc=False)
+        except (UnexpectedlyNotJSON, requests.RequestException):
+            pass  # yielded anyway, without state
+        finally:
+            done.put((nav, depth))
+
+    while queued or in_flight:
+        while queued and in_flight < workers:
+            nav, depth = queued[0]
+            if nav._needs_fetch:
+                if max_requests is not None and \
+                        requests_made >= max_requests:
+                    break
+                requests_made += 1
+                in_flight += 1
+                api.apply_async(fetch, (nav, depth))
+            else:
+                done.put((nav, depth))
+                in_flight += 1
+            queued.popleft()
+        if not in_flight:
+            break  # out of requests
+        nav, depth = done.get()
+        in_flight -= 1
+        yield nav
+        if max_depth is not None and depth >= max_depth:
+            continue
+        for linked in _linked_navs(nav, rel_filter, template_args):
+            if linked.uri not in seen:
+                seen.add(linked.uri)
+                queued.append((linked, depth + 1))
+
+
+def _linked_navs(nav, rel_filter, template_args):
+    """The navigators linked from nav that the crawl should visit"""
+    if nav.state is None:
+        return
+    rels = rel_filter
+    if callable(rel_filter):
+        rels = [rel for rel in (nav._links or {}) if rel_filter(rel)]
+    for linked in nav._iter_linked_navs(rels):
+        if linked.templated:
+            if template_args is None or \
+                    not linked.parameters <= set(template_args):
+                continue
+            linked = linked.expand(**dict(
+                (param, template_args[param]) for param in linked.parameters))
+        if linked.cacheable:
+            yield linked
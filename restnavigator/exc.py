@@ -35,6 +35,12 @@ class HALNavigatorError(Exception):
         super(HALNavigatorError, self).__init__(message)
 
 
+class DeadlineExceeded(HALNavigatorError):
+    """Raised instead of making a request when the deadline it was made
+    under has passed"""
+    pass
+
+
 class UnexpectedlyNotJSON(TypeError):
     """Raised when a non-json parseable resource is gotten"""
 
@@ -6,22 +6,44 @@ from restnavigator.exc import UnexpectedlyNotJSON, HALNavigatorError
 
 __version__ = '0.2'
 
-import copy
 from weakref import WeakValueDictionary
+import collections
+import contextlib
 import functools
+import threading
+import time
+import sys
+import Queue
 import httplib
 import re
-import json
 import urlparse
 import webbrowser
 import urllib
 
 import requests
 import cachecontrol
+from cachecontrol.cache import BaseCache
 import unidecode
 import uritemplate
 
 from restnavigator import exc, utils
+from restnavigator.cache import CacheAdapter, SQLiteCache
+
+
+# How many bytes of a streamed response are read at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+# How many compiled uri templates are kept per api
+TEMPLATE_CACHE_SIZE = 256
+# Default number of entries and lifetime (in seconds) of path caches
+PATH_CACHE_SIZE = 1024
+PATH_CACHE_TTL = 60
+# The request hooks that can be registered, see HALNavigator.add_hook
+HOOKS = ('before_request', 'after_response', 'after_parse', 'on_error',
+         'on_identity_map_hit')
+# Seconds a request may wait for a connection or for data before it fails
+DEFAULT_TIMEOUT = 60
 
 
 def default_headers():
@@ -30,6 +52,51 @@ def default_headers():
             'User-Agent': 'HALNavigator/{}'.format(__version__)}
 
 
+def tune_connection_pools(session, pool_connections=None, pool_maxsize=None,
+                          min_pool_maxsize=None):
+    """Resizes the connection pools of the adapters mounted for http and https
+    on a session. pool_connections is the number of hosts to keep pools for,
+    pool_maxsize the number of connections kept open per host. None leaves
+    a setting as it is, except that pools smaller than min_pool_maxsize are
+    grown to it"""
+    seen = set()
+    for prefix in ('http://', 'https://'):
+        adapter = session.get_adapter(prefix)
+        if id(adapter) in seen or \
+                not isinstance(adapter, requests.adapters.HTTPAdapter):
+            continue
+        seen.add(id(adapter))
+        connections = pool_connections or adapter._pool_connections
+        maxsize = pool_maxsize or max(adapter._pool_maxsize,
+                                      min_pool_maxsize or 0)
+        if (connections, maxsize) != (adapter._pool_connections,
+                                      adapter._pool_maxsize):
+            adapter._pool_connections = connections
+            adapter._pool_maxsize = maxsize
+            adapter.init_poolmanager(connections, maxsize,
+                                     block=adapter._pool_block)
+
+
+def mark_stale(nav):
+    """Makes a navigator whose state is too old to use fetch it again the
+    next time it's used. It only sets a flag, the state is left alone for
+    whoever is still using it, so this is safe to call from any thread"""
+    nav._stale = True
+
+
+def make_retry_policy(retry):
+    """The RetryPolicy for the `retry` argument of HALNavigator. That may be
+    a RetryPolicy, the maximum number of attempts, True for the default
+    policy, or None/False to never retry"""
+    if isinstance(retry, utils.RetryPolicy):
+        return retry
+    elif retry is True:
+        return utils.RetryPolicy()
+    elif retry:
+        return utils.RetryPolicy(max_attempts=retry)
+    return None
+
+
 def restrict_to(methods=[], templated=None, idempotent=None):
     """A decorator to restrict Navigator functions based on certain criteria
 
@@ -82,18 +149,128 @@ def autofetch(fn):
 
     @functools.wraps(fn)
     def wrapped(self, *args, **qargs):
-        if self.idempotent and self.response is None:
+        if self.idempotent and self._needs_fetch:
+            self._api.metrics.add('autofetches')
             self.get(raise_exc=qargs.get('raise_exc', False))
         return fn(self, *args, **qargs)
 
     return wrapped
 
 
+class APIContext(object):
+    """The state shared by every Navigator of one api. Navigators only hold
+    a reference to it, so cloning a Navigator doesn't copy any of this"""
+
+    def __init__(self, root, apiname, session, default_curie, max_workers,
+                 stream, json_codec, retained=None, retry=None,
+                 timeout=None, paths=None, hooks=None):
+        self.root = root
+        self.apiname = apiname
+        self.session = session
+        self.default_curie = default_curie
+        # Whether GET responses are parsed while they are downloaded
+        self.stream = stream
+        self.json = json_codec
+        # Compiled uri templates, keyed by template
+        self.templates = utils.LRUCache(TEMPLATE_CACHE_SIZE)
+        # This is the identity map shared by all descendents of the root
+        # HALNavigator
+        self.id_map = WeakValueDictionary()
+        self.id_map_lock = threading.RLock()
+        # An optional LRUCache keeping recently fetched Navigators strongly
+        # referenced, so they stay in the id_map after user code drops them
+        self.retained = retained
+        # The RetryPolicy for requests to this api, or None to never retry
+        self.retry = retry
+        # The timeout for each request, possibly shortened by a deadline
+        self.timeout = timeout
+        self._local = threading.local()
+        # An optional LRUCache of where chains of rels led to before
+        self.paths = paths
+        # Background requests (the *_async methods) for this api all run on
+        # this pool
+        self.workers = utils.WorkerPool(max_workers)
+        self.metrics = utils.Metrics()
+        # Request hooks by name, and the event of the request being handled
+        # in each thread
+        self.hooks = {}
+        for name, fns in (hooks or {}).iteritems():
+            for fn in (fns if isinstance(fns, (list, tuple)) else [fns]):
+                self.add_hook(name, fn)
+
+    @property
+    def deadline(self):
+        """The Deadline requests made in this thread must meet, or None"""
+        return getattr(self._local, 'deadline', None)
+
+    @deadline.setter
+    def deadline(self, deadline):
+        self._local.deadline = deadline
+
+    @property
+    def event(self):
+        """The HookEvent of the last request made in this thread"""
+        return getattr(self._local, 'event', None)
+
+    @event.setter
+    def event(self, event):
+        self._local.event = event
+
+    def add_hook(self, name, fn):
+        if name not in HOOKS:
+            raise ValueError('Unknown hook {!r}, expected one of {}'.format(
+                name, ', '.join(HOOKS)))
+        # Copied on write, so firing hooks needs no lock
+        self.hooks = dict(self.hooks)
+        self.hooks[name] = self.hooks.get(name, ()) + (fn,)
+
+    def remove_hook(self, name, fn):
+        hooks = dict(self.hooks)
+        hooks[name] = tuple(h for h in hooks.get(name, ()) if h is not fn)
+        self.hooks = hooks
+
+    def fire(self, name, event):
+        """Calls the hooks registered for `name` with event"""
+        hooks = self.hooks.get(name)
+        if hooks:
+            event.name = name
+            for hook in hooks:
+                hook(event)
+
+    def carry_deadline(self, fn):
+        """Wraps fn so that it runs under the deadline of the calling thread,
+        whichever thread it's eventually called in"""
+        deadline = self.deadline
+
+        def run(*args, **kwargs):
+            self.deadline = deadline
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.deadline = None
+        return run
+
+    def apply_async(self, fn, args=(), kwargs=None):
+        """Runs fn(*args, **kwargs) on the worker pool, under the deadline of
+        the calling thread. Returns an AsyncResult"""
+        return self.workers.apply_async(self.carry_deadline(fn), args, kwargs)
+
+
 class HALNavigator(object):
     """The main navigation entity"""
 
-    # See NonIdempotentResponse for a non-idempotent Navigator
-    idempotent = True
+    # The per-resource attributes, which are all that's copied when cloning.
+    # Everything api-wide lives on the APIContext in _api
+    _resource_attrs = (
+        '_api', 'uri', 'profile', 'title', 'type', 'curies', 'response',
+        'state', 'template_uri', 'template_args', 'parameters', 'templated',
+        '_link_dict', '_link_source', 'method', 'method_validation',
+        'idempotent', 'fetched', 'parent', '_validators', 'rel',
+        '_from_embedded', '_stale',
+    )
+    # _repr_cache isn't cloned, it's only valid for the Navigator that
+    # computed it
+    __slots__ = _resource_attrs + ('_repr_cache', '__weakref__')
 
     def __init__(self, root,
                  apiname=None,
@@ -101,27 +278,70 @@ class HALNavigator(object):
                  headers=None,
                  session=None,
                  cache=False,
-                 curie=None):
-        self.root = utils.fix_scheme(root)
-        self.apiname = utils.namify(root) if apiname is None else apiname
-        self.uri = self.root
-        self.profile = None
-        self.title = None
-        self.type = 'application/hal+json'
-        self.default_curie = curie
-        self.curies = None
-        self.session = session or requests.Session()
+                 curie=None,
+                 max_workers=10,
+                 stream=False,
+                 json_codec=None,
+                 retain=None,
+                 retain_bytes=None,
+                 retain_ttl=None,
+                 pool_connections=None,
+                 pool_maxsize=None,
+                 keep_alive=True,
+                 retry=None,
+                 timeout=DEFAULT_TIMEOUT,
+                 path_cache=False,
+                 path_cache_ttl=PATH_CACHE_TTL,
+                 hooks=None):
+        if stream and utils.ijson is None:
+            raise ImportError('Streaming responses requires the ijson package')
+        if retain_ttl is not None and not (retain or retain_bytes):
+            raise ValueError('retain_ttl needs retain or retain_bytes')
+        session = session or requests.Session()
         if cache:
             if isinstance(cache, cachecontrol.CacheControlAdapter):
                 cc = cache
+            elif isinstance(cache, BaseCache):
+                cc = CacheAdapter(cache=cache)
+            elif isinstance(cache, basestring):
+                cc = CacheAdapter(cache=SQLiteCache(cache))
             else:
-                cc = cachecontrol.CacheControlAdapter()
-            self.session.mount('http://', cc)
-            self.session.mount('https://', cc)
-        self.session.auth = auth
-        self.session.headers.update(default_headers())
+                cc = CacheAdapter()
+            session.mount('http://', cc)
+            session.mount('https://', cc)
+        # Unless told otherwise, keep a connection open for every worker, so
+        # background requests don't queue up for connections
+        tune_connection_pools(session, pool_connections, pool_maxsize,
+                              min_pool_maxsize=max_workers)
+        session.auth = auth
+        session.headers.update(default_headers())
+        if not keep_alive:
+            session.headers['Connection'] = 'close'
         if headers:
-            self.session.headers.update(headers)
+            session.headers.update(headers)
+        self._api = APIContext(
+            root=utils.fix_scheme(root),
+            apiname=utils.namify(root) if apiname is None else apiname,
+            session=session,
+            default_curie=curie,
+            max_workers=max_workers,
+            stream=stream,
+            json_codec=utils.JSONCodec(json_codec),
+            retained=utils.LRUCache(retain, retain_bytes, retain_ttl,
+                                    on_expire=mark_stale)
+            if retain or retain_bytes else None,
+            retry=make_retry_policy(retry),
+            timeout=timeout,
+            paths=utils.LRUCache(
+                PATH_CACHE_SIZE if path_cache is True else path_cache,
+                ttl=path_cache_ttl) if path_cache else None,
+            hooks=hooks,
+        )
+        self.uri = self.root
+        self.profile = None
+        self.title = None
+        self.type = 'application/hal+json'
+        self.curies = None
         self.response = None
         self.state = None
         self.template_uri = None
@@ -129,25 +349,56 @@ class HALNavigator(object):
         self.parameters = None
         self.templated = False
         self._links = None
-        # This is the identity map shared by all descendents of this
-        # HALNavigator
-        self._id_map = WeakValueDictionary({self.root: self})
         self.method = ['GET']
         self.method_validation = False
+        # See _create_non_idempotent_response for a non-idempotent Navigator
+        self.idempotent = True
+        self.fetched = False
+        self.parent = None
+        # Conditional request headers to revalidate the current state with
+        self._validators = None
+        # Whether the state came from a resource this one was embedded in
+        self._from_embedded = False
+        # Whether the state is out of date (see mark_stale)
+        self._stale = False
+        # The rel this Navigator was first linked by
+        self.rel = None
+        self._api.id_map[self.root] = self
+
+    @property
+    def root(self):
+        return self._api.root
+
+    @property
+    def metrics(self):
+        """The api's Metrics, shared by all its navigators"""
+        return self._api.metrics
+
+    @property
+    def apiname(self):
+        return self._api.apiname
+
+    @property
+    def session(self):
+        return self._api.session
+
+    @property
+    def default_curie(self):
+        return self._api.default_curie
 
     @classmethod
     def init_from_hal_json(cls, root_uri, hal_response):
         root_uri = utils.fix_scheme(root_uri)
+        _halnavigator = cls(root_uri)
 
         try:
-            hal_json = json.loads(hal_response)
+            hal_json = _halnavigator._api.json.loads(hal_response)
         except ValueError:
             raise UnexpectedlyNotJSON(
                 'Need a valid HAL-JSON to initialise the Navigator', hal_response)
 
-        _halnavigator = cls(root_uri)
         _halnavigator.response = hal_response
-        _halnavigator._populate_navigator_properties(hal_json)
+        _halnavigator._populate_from_body(hal_json)
 
         return _halnavigator
 
@@ -199,7 +450,7 @@ class HALNavigator(object):
     @autofetch
     def links(self):
         r"""Returns dictionary of navigators from the current resource."""
-        return dict(self._links)
+        return dict(self._links.iteritems())
 
     @property
     def status(self):
@@ -207,6 +458,19 @@ class HALNavigator(object):
             return self.response.status_code, self.response.reason
 
     def __repr__(self):
+        # The repr only depends on the uri (or template uri), so it's cached
+        # until one of those changes
+        key = (self.uri, self.template_uri)
+        try:
+            cached_key, cached = self._repr_cache
+            if cached_key == key:
+                return cached
+        except AttributeError:
+            pass
+        self._repr_cache = key, self._make_repr()
+        return self._repr_cache[1]
+
+    def _make_repr(self):
         def path_clean(chunk):
             if not chunk:
                 return chunk
@@ -231,14 +495,34 @@ class HALNavigator(object):
     def __ne__(self, other):
         return not self == other
 
+    @property
+    def _needs_fetch(self):
+        """Whether this navigator hasn't been fetched, or its state is out
+        of date"""
+        return self.response is None or self._stale
+
     def __call__(self, raise_exc=True):
-        if self.response is None:
+        if self._needs_fetch:
             return self.fetch(raise_exc=raise_exc)
         else:
             return self.state.copy()
 
     def __iter__(self):
         """Part of iteration protocol"""
+        return self.iterate()
+
+    def iterate(self, read_ahead=0):
+        """Iterates over this resource and those following it through 'next'
+        links.
+
+        If `read_ahead` is greater than 0, a background thread fetches up to
+        that many pages ahead of the caller, so the network requests overlap
+        with processing of the current page. Pages are yielded fetched."""
+        if read_ahead > 0:
+            return self._iterate_with_read_ahead(read_ahead)
+        return self._iterate_serially()
+
+    def _iterate_serially(self):
         yield self
         last = self
         while True:
@@ -246,6 +530,51 @@ class HALNavigator(object):
             yield current
             last = current
 
+    def _iterate_with_read_ahead(self, read_ahead):
+        pages = Queue.Queue(maxsize=read_ahead)
+        stopped = threading.Event()
+
+        def put(item):
+            """Blocks while the buffer is full, unless the consumer is gone"""
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def produce():
+            current = self
+            try:
+                while current is not None:
+                    try:
+                        following = current.next()  # fetches current
+                    except StopIteration:
+                        following = None
+                    if not put(('page', current)):
+                        return
+                    current = following
+            except Exception:
+                put(('error', sys.exc_info()))
+            else:
+                put(('done', None))
+
+        producer = threading.Thread(target=self._api.carry_deadline(produce))
+        producer.daemon = True
+        producer.start()
+        try:
+            while True:
+                kind, value = pages.get()
+                if kind == 'page':
+                    yield value
+                elif kind == 'error':
+                    raise value[0], value[1], value[2]
+                else:
+                    return
+        finally:
+            stopped.set()
+
     @autofetch
     def __nonzero__(self):
         # we override normal exception throwing since the user seems interested
@@ -261,10 +590,12 @@ class HALNavigator(object):
     @restrict_to(methods=['GET'])
     def __getitem__(self, getitem_args):
         r"""Subselector for a HALNavigator"""
+        hops = []
 
         @autofetch
         def dereference(n, rels):
             """Helper to recursively dereference"""
+            hops.append(n)
             if len(rels) == 1:
                 ret = n._links[rels[0]]
                 if isinstance(ret, list):
@@ -281,7 +612,14 @@ class HALNavigator(object):
             getitem_args)
         if slug and ellipsis:
             raise SyntaxError("':' and '...' syntax cannot be combined!")
-        if rels:
+        if len(rels) > 1:
+            n = self._resolve_path(
+                ('getitem', tuple(rels)), lambda: (dereference(self, rels), hops))
+            if isinstance(n, list):
+                n = [r._make_nav() if r.templated else r for r in n]
+            elif n.templated:
+                n = n._make_nav()
+        elif rels:
             n = dereference(self, rels)
         else:
             n = self
@@ -289,6 +627,31 @@ class HALNavigator(object):
             n = n.expand(_keep_templated=ellipsis, **qargs)
         return n
 
+    def _resolve_path(self, path, resolve):
+        """Returns what following a path from this navigator leads to.
+
+        `resolve` does the actual traversal. It returns the result, and the
+        navigators whose links were followed to get there. If the api has a
+        path cache, the result is remembered as long as the responses of
+        those navigators stay fresh (and at most the path cache's ttl), and
+        following the same path again returns it without any requests"""
+        paths = self._api.paths
+        if paths is None or not self.cacheable:
+            return resolve()[0]
+        key = (self.uri,) + path
+        result = paths.get(key)
+        if result is None:
+            result, hops = resolve()
+            lifetimes = [utils.freshness_lifetime(hop.response, paths.ttl)
+                         for hop in hops]
+            lifetimes = [lt for lt in lifetimes if lt is not None]
+            if paths.ttl is not None:
+                lifetimes.append(paths.ttl)
+            ttl = min(lifetimes) if lifetimes else None
+            if ttl is None or ttl > 0:
+                paths.set(key, result, ttl=ttl)
+        return result
+
     @autofetch
     def docsfor(self, rel):
         """Obtains the documentation for a link relation. Opens in a webbrowser
@@ -304,10 +667,11 @@ class HALNavigator(object):
     def _make_linked_nav_from(self, body):
         """Creates linked navigators from a HAL response body"""
 
-        def process_links(link):
+        def process_links(rel, link):
             """Extract URI from each link to craft the Navigators """
             if isinstance(link, list):
-                return utils.LinkList((process_links(lnk), lnk) for lnk in link)
+                return utils.LinkList(
+                    (process_links(rel, lnk), lnk) for lnk in link)
             templated = link.get('templated', False)
             if not templated:
                 uri = urlparse.urljoin(self.uri, link['href'])
@@ -324,36 +688,228 @@ class HALNavigator(object):
                 type=link.get('type'),
                 profile=link.get('profile'),
                 method=method,
+                rel=rel,
             )
             if templated:
                 cp.uri = None
-                cp.parameters = uritemplate.variables(cp.template_uri)
+                cp.parameters = set(
+                    self._compiled_template(cp.template_uri).variables)
             else:
                 cp.template_uri = None
             return cp
 
+        curies = body.get('_links', {}).get('curies', [])
+        if isinstance(curies, dict):
+            curies = [curies]
         return utils.LinkDict(
             self.default_curie,
-            {rel: process_links(links)
+            {rel: process_links(rel, links)
              for rel, links in body.get('_links', {}).iteritems()
-             if rel not in ['self', 'curies']})
+             if rel not in ['self', 'curies']},
+            curies=[curie.get('name') for curie in curies])
 
-    def _populate_navigator_properties(self, raise_exc=True):
+    @property
+    def _links(self):
+        """The LinkDict of the linked navigators. After a fetch it's only
+        built the first time it's needed, and until then the previous one
+        is kept, so the navigators it holds stay in the identity map and are
+        reused"""
+        source = self._link_source
+        if source is None:
+            return self._link_dict
+        links = source()
+        if self._link_source is source:
+            self._link_dict, self._link_source = links, None
+        return links
+
+    @_links.setter
+    def _links(self, links):
+        self._link_dict = links
+        self._link_source = None
+
+    def _iter_linked_navs(self, rels=None):
+        """Yields the navigators linked from this resource, restricted to the
+        given rels if any. Doesn't fetch anything"""
+        links = self._links or {}
+        if rels is None:
+            groups = links.values()
+        else:
+            groups = []
+            for rel in rels:
+                try:
+                    groups.append(links[rel])
+                except KeyError:
+                    pass
+        for group in groups:
+            if isinstance(group, list):
+                for nav in group:
+                    yield nav
+            else:
+                yield group
+
+    @autofetch
+    def prefetch(self, rels=None, depth=1):
+        """Fetches linked resources concurrently on the api's worker pool, so
+        that later accessing them doesn't go over the network.
+
+        `rels` is a rel (or list of rels) to follow, by default all of them
+        `depth` is how many links away from this resource to prefetch
+
+        Templated links are never followed, resources that were already
+        fetched aren't fetched again. Returns the navigators that were
+        fetched."""
+        if isinstance(rels, basestring):
+            rels = [rels]
+        seen = set([self.uri])
+        frontier = [self]
+        fetched = []
+        for _ in xrange(depth):
+            level = []
+            for nav in frontier:
+                for linked in nav._iter_linked_navs(rels):
+                    if linked.cacheable and linked.uri not in seen:
+                        seen.add(linked.uri)
+                        level.append(linked)
+            pending = [(nav, nav.get_async(raise_exc=False))
+                       for nav in level if nav._needs_fetch]
+            for nav, result in pending:
+                result.get()
+                fetched.append(nav)
+            frontier = level
+        return fetched
+
+    def _make_embedded_navs_from(self, body):
+        """Creates pre-populated navigators from the embedded resources in a
+        HAL response body, keyed by rel. Embedded documents without a self
+        link can't go into the identity map, so they are skipped (they are
+        still available in the state)"""
+
+        def process_embedded(rel, doc):
+            """Turns an embedded document into a fetched Navigator"""
+            if isinstance(doc, list):
+                navs = []
+                for d in doc:
+                    nav = process_embedded(rel, d)
+                    if nav is not None:
+                        navs.append((nav, d['_links']['self']))
+                return utils.LinkList(navs) if navs else None
+            if not has_self_link(doc):
+                return None
+            self_link = doc['_links']['self']
+            uri = urlparse.urljoin(self.uri, self_link['href'])
+            if uri == self.uri:
+                return None
+            cp = self._make_nav(
+                uri=uri,
+                templated=False,
+                type=self_link.get('type'),
+                profile=self_link.get('profile'),
+                rel=rel,
+            )
+            if cp.response is not None and not cp._from_embedded:
+                # Already in the identity map with a state of its own, which
+                # an embedded (possibly partial) copy mustn't replace
+                return cp
+            cp.template_uri = None
+            # The embedded document is the representation of the resource,
+            # so the response that carried it stands in for a GET
+            cp.response = self.response
+            cp._from_embedded = True
+            cp._populate_from_body(doc)
+            return cp
+
+        def has_self_link(doc):
+            return (isinstance(doc, dict) and
+                    'href' in doc.get('_links', {}).get('self', {}))
+
+        embedded = {}
+        for rel, docs in body.get('_embedded', {}).iteritems():
+            navs = process_embedded(rel, docs)
+            if navs is not None:
+                embedded[rel] = navs
+        return embedded
+
+    def _populate_navigator_properties(self, raise_exc=True, streamed=False):
+        """Parses the response. If `streamed`, the response body hasn't been
+        read yet, and it's parsed incrementally as it's downloaded. Returns
+        the size of the body"""
+        api = self._api
+        event = api.event
+        if event is not None and event.nav is not self:
+            event = None
+        started = time.time()
+        if streamed:
+            chunks = utils.ByteCounter(
+                self.response.iter_content(STREAM_CHUNK_SIZE))
         try:
-            body = json.loads(self.response.text)
-        except ValueError:
+            if streamed:
+                body = utils.load_json_stream(chunks)
+            else:
+                body = self._api.json.loads(utils.json_body(
+                    self.response.content,
+                    self.response.headers.get('Content-Type')))
+        except ValueError as e:
+            if streamed:
+                # the rest of the body wasn't read, so the connection can't
+                # go back to the pool
+                self.response.close()
+            size = self._body_size(chunks if streamed else None)
+            parse_time = time.time() - started
+            api.metrics.add('parse_time', parse_time)
+            if event is not None:
+                event.parse_time = parse_time
+                event.error = e
+                api.fire('on_error', event)
             if raise_exc:
                 raise UnexpectedlyNotJSON(
                     "The resource at {.uri} wasn't valid JSON", self.response)
             self.state = {}
             self._links = utils.LinkDict(self.default_curie, {})
             self.method = None
-            return
-
+            return size
+
+        size = self._body_size(chunks if streamed else None)
+        self._populate_from_body(body)
+        parse_time = time.time() - started
+        api.metrics.add('parse_time', parse_time)
+        if event is not None:
+            event.parse_time = parse_time
+            api.fire('after_parse', event)
+        return size
+
+    def _body_size(self, chunks=None):
+        """The size of the response body. For a streamed body, that's
+        what `chunks` counted while it was read. If there was no
+        Content-Length header, that count wasn't in the metrics yet."""
+        if chunks is None:
+            return len(self.response.content)
+        if 'Content-Length' not in self.response.headers:
+            self._api.metrics.record_body(self.response, chunks.count)
+            event = self._api.event
+            if event is not None and event.nav is self:
+                event.bytes = chunks.count
+        return chunks.count
+
+    def _populate_from_body(self, body):
+        """Sets links, curies and state from an already parsed HAL body"""
         self.method = [method.upper() for method in body.get('method', ['GET'])]
 
         if 'GET' in self.method:
-            self._links = self._make_linked_nav_from(body)
+            # Embedded resources are hydrated first so the linked navigators
+            # for the same uris come out of the identity map already fetched.
+            # The source keeps them alive until the links are built.
+            embedded = self._make_embedded_navs_from(body)
+            # Linked navigators are cloned from a snapshot of this navigator
+            # as it is now. This also keeps the source from referencing self
+            prototype = self.clone_navigator({})
+
+            def build_links():
+                links = prototype._make_linked_nav_from(body)
+                for rel, navs in embedded.iteritems():
+                    if rel not in links:
+                        links[rel] = navs
+                return links
+            self._link_source = build_links
             self.title = (body.get('_links', {})
                           .get('self', {})
                           .get('title', self.title))
@@ -365,12 +921,21 @@ class HALNavigator(object):
     def clone_navigator(self, params):
         """ Creates a shallow copy of the HALNavigator that extra attributes can
         be set on."""
-        cp = copy.copy(self)
+        cls = type(self)
+        cp = cls.__new__(cls)
+        for attr in self._resource_attrs:
+            setattr(cp, attr, getattr(self, attr))
+        if hasattr(self, '__dict__'):
+            # subclasses without __slots__ may have attributes of their own
+            cp.__dict__.update(self.__dict__)
         cp.idempotent = True
         cp._links = None
         cp.response = None
         cp.state = None
         cp.fetched = False
+        cp._validators = None
+        cp._from_embedded = False
+        cp._stale = False
         for attr, val in params.iteritems():
             if val is not None:
                 setattr(cp, attr, val)
@@ -382,12 +947,91 @@ class HALNavigator(object):
         instead.
         If the object is templated, it doesn't go into the id_map
         """
-        if 'uri' in kwargs and kwargs['uri'] in self._id_map:
-            return self._id_map[kwargs['uri']]
-        cp = self.clone_navigator(kwargs)
-        if cp.cacheable:
-            self._id_map[cp.uri] = cp
-        return cp
+        id_map = self._api.id_map
+        with self._api.id_map_lock:
+            if 'uri' in kwargs and kwargs['uri'] in id_map:
+                nav = id_map[kwargs['uri']]
+                self._api.metrics.add('id_map_hits')
+                if self._api.hooks.get('on_identity_map_hit'):
+                    self._api.fire('on_identity_map_hit', utils.HookEvent(nav))
+                if self._api.retained is not None:
+                    # Counts as a use. If its ttl ran out, this makes it
+                    # fetch its state again
+                    self._api.retained.get(nav.uri)
+                return nav
+            cp = self.clone_navigator(kwargs)
+            if cp.cacheable:
+                self._api.metrics.add('id_map_misses')
+                id_map[cp.uri] = cp
+            return cp
+
+    def _compiled_template(self, template_uri):
+        """Returns the compiled template for a uri template, from the api's
+        template cache if possible"""
+        template = self._api.templates.get(template_uri)
+        if template is None:
+            template = utils.CompiledTemplate(template_uri)
+            self._api.templates[template_uri] = template
+        return template
+
+    def warm_up(self, n=1):
+        """Opens up to `n` connections to the api's host ahead of the first
+        requests, so they don't have to wait for TCP and TLS handshakes.
+
+        At most as many connections as the pool keeps per host are opened.
+        Returns the number of connections that are ready"""
+        adapter = self.session.get_adapter(self.root)
+        pool = adapter.poolmanager.connection_from_url(self.root)
+        conns = [pool._get_conn() for _ in range(min(n, pool.pool.maxsize))]
+        try:
+            for conn in conns:
+                if conn.sock is None:
+                    conn.connect()
+        finally:
+            for conn in conns:
+                pool._put_conn(conn)
+        return sum(1 for conn in conns if conn.sock is not None)
+
+    @contextlib.contextmanager
+    def deadline(self, seconds):
+        """A context manager that makes every request made inside it (by any
+        navigator of this api, in the current thread) finish within
+        `seconds` altogether. Each request gets the time that's left as its
+        timeout, and DeadlineExceeded is raised once it's used up.
+
+        Deadlines can be nested, the earlier one wins. With None, requests
+        inside are only limited by the api's timeout"""
+        api = self._api
+        outer = api.deadline
+        if seconds is not None:
+            deadline = utils.Deadline(seconds)
+            if outer is None or deadline.expires < outer.expires:
+                api.deadline = deadline
+        try:
+            yield
+        finally:
+            api.deadline = outer
+
+    def add_hook(self, name, fn):
+        """Registers fn to be called with a HookEvent at a point in the life
+        of every request to the api. `name` is one of:
+
+          before_request       before a request is sent
+          after_response       when its response has arrived
+          after_parse          when the response body has been parsed
+          on_error             when a request fails, a response has an error
+                               status, or its body can't be parsed
+          on_identity_map_hit  when a link leads to a navigator that's
+                               already in the identity map
+
+        Hooks apply to every navigator of the api. They can also be given as
+        a dict of name to function (or list of functions) with the `hooks`
+        argument of the root navigator"""
+        self._api.add_hook(name, fn)
+
+    def remove_hook(self, name, fn):
+        """Unregisters a hook added with add_hook"""
+        self._api.remove_hook(name, fn)
 
     def authenticate(self, auth):
         """Allows setting authentication for future requests to the api"""
@@ -410,7 +1054,8 @@ class HALNavigator(object):
 
         if self.template_args is not None:
             kwargs.update(self.template_args)
-        cp = self._make_nav(uri=uritemplate.expand(self.template_uri, kwargs),
+        template = self._compiled_template(self.template_uri)
+        cp = self._make_nav(uri=template.expand(kwargs),
                             templated=_keep_templated)
         if not _keep_templated:
             cp.template_uri = None
@@ -426,7 +1071,8 @@ class HALNavigator(object):
                           raise_exc=True,
                           content_type='application/json',
                           json_cls=None,
-                          headers=None):
+                          headers=None,
+                          stream=False):
         """
             Fetches HTTP response using http method (POST or DELETE of requests.Session)
         resource. Returns a new HALNavigator representing that resource.
@@ -435,17 +1081,69 @@ class HALNavigator(object):
             as json
         `content_type` may be modified if necessary
         `json_cls` is a JSONEncoder to use rather than the standard
-        `headers` are additional headers to send in the request"""
+        `headers` are additional headers to send in the request
+        `stream` leaves the body of a successful response unread
+
+        Failed requests are retried according to the api's retry policy.
+        Each attempt times out after the api's timeout, or when the current
+        deadline (see `deadline`) passes if that's sooner"""
 
         if isinstance(body, dict):
-            body = json.dumps(body, cls=json_cls, separators=(',', ':'))
+            body = self._api.json.dumps(body, cls=json_cls)
         headers = {} if headers is None else headers
         headers['Content-Type'] = content_type
-        self.response = response = http_method_fn(
-            self.uri,
-            data=body,
-            headers=headers,
-            allow_redirects=False)
+
+        def send():
+            timeout = self._api.timeout
+            deadline = self._api.deadline
+            if deadline is not None:
+                if deadline.remaining() <= 0:
+                    raise exc.DeadlineExceeded(
+                        message='Deadline passed before requesting ' + self.uri,
+                        nav=self,
+                    )
+                timeout = deadline.cap(timeout)
+            return http_method_fn(
+                self.uri,
+                data=body,
+                headers=headers,
+                allow_redirects=False,
+                stream=stream,
+                timeout=timeout)
+        api = self._api
+        method = getattr(http_method_fn, '__name__', '').upper()
+        api.event = event = utils.HookEvent(self, method) if api.hooks else None
+        if event is not None:
+            api.fire('before_request', event)
+            started = time.time()
+        try:
+            if api.retry is None:
+                response = send()
+            else:
+                response = api.retry.call(method, send, api.deadline)
+        except Exception as e:
+            api.metrics.add('errors')
+            if event is not None:
+                event.network_time = time.time() - started
+                event.error = e
+                api.fire('on_error', event)
+            raise
+        self.response = response
+        self._from_embedded = False
+        self._stale = False
+        if stream:
+            length = response.headers.get('Content-Length')
+            size = int(length) if length else None
+        else:
+            size = len(response.content)
+        api.metrics.record_response(method, response, size or 0)
+        if event is not None:
+            event.network_time = time.time() - started
+            event.status = response.status_code
+            event.bytes = size
+            api.fire('after_response', event)
+            if not response:
+                api.fire('on_error', event)
         if raise_exc and not response:
             raise HALNavigatorError(
                 message=response.text,
@@ -470,7 +1168,7 @@ class HALNavigator(object):
             if method.upper() in ['POST', 'DELETE']:
                 return self._create_non_idempotent_response()
             elif method.upper() == 'GET':
-                return self._populate_navigator_properties()
+                self._populate_navigator_properties()
         else:
             '''
                 Expected hits:
@@ -503,14 +1201,98 @@ class HALNavigator(object):
 
     @restrict_to(methods='GET', templated=True, idempotent=True)
     def get(self, raise_exc=True):
-        """Like __call__, but doesn't cache, always makes the request"""
+        """Like __call__, but doesn't cache, always makes the request.
+
+        If the last response had an ETag or Last-Modified header, the request
+        is conditional, and when the server answers 304 Not Modified the
+        current state and links are kept without reparsing anything."""
         # self._fetch_hal_and_create_resource(self.session.get)
-        self.get_http_response(self.session.get, raise_exc=raise_exc)
-        self._populate_navigator_properties(raise_exc)
+        self._revalidate(raise_exc)
         return self.state
 
     fetch = get
 
+    @restrict_to(methods='GET', templated=True, idempotent=True)
+    def refresh(self, raise_exc=True):
+        """Brings the resource up to date, cheaply if it hasn't changed on
+        the server (see get). Returns whether it had changed"""
+        return self._revalidate(raise_exc)
+
+    def _revalidate(self, raise_exc):
+        """Does a (conditional if possible) GET. Returns False if the server
+        said the current state is still valid"""
+        previous = self.response
+        headers = None
+        if self._validators is not None and self.state is not None:
+            headers = dict(self._validators)
+        stream = self._api.stream
+        response = self.get_http_response(
+            self.session.get, raise_exc=raise_exc, headers=headers,
+            stream=stream)
+        if headers is not None and response.status_code == httplib.NOT_MODIFIED:
+            # The previous response still describes the resource
+            self.response = previous
+            response.close()
+            return False
+        size = self._populate_navigator_properties(raise_exc, streamed=stream)
+        self._validators = None
+        if response.status_code == httplib.OK:
+            validators = {}
+            if 'ETag' in response.headers:
+                validators['If-None-Match'] = response.headers['ETag']
+            if 'Last-Modified' in response.headers:
+                validators['If-Modified-Since'] = \
+                    response.headers['Last-Modified']
+            self._validators = validators or None
+            self._retain(size)
+        return True
+
+    def _retain(self, size):
+        """Keeps a freshly fetched Navigator strongly referenced, if the api
+        was asked to retain them. `size` is the size of its response body"""
+        retained = self._api.retained
+        if retained is None or not self.cacheable:
+            return
+        retained.set(self.uri, self, weight=size)
+
+    @staticmethod
+    def fetch_many(navigators, max_workers=10):
+        """Fetches many navigators concurrently on their api's worker pool,
+        with at most `max_workers` requests of this batch in flight.
+
+        Returns a list in the same order as `navigators`. Each entry is
+        either the (now fetched) navigator, or the HALNavigatorError that
+        fetching it raised, so one failure doesn't abort the whole batch."""
+        navigators = list(navigators)
+
+        def fetch_one(nav):
+            try:
+                nav.get()
+                return nav
+            except HALNavigatorError as e:
+                return e
+            except (UnexpectedlyNotJSON, requests.RequestException,
+                    exc.AmbiguousNavigationError, exc.InvalidOperation) as e:
+                return HALNavigatorError(
+                    message=unicode(e),
+                    nav=nav,
+                    status=nav.status and nav.status[0],
+                    response=nav.response,
+                )
+
+        # the same navigator may be in the list more than once, but should
+        # only be fetched once
+        results = {}
+        in_flight = collections.deque()
+        for nav in navigators:
+            if id(nav) in results:
+                continue
+            if len(in_flight) >= max_workers:
+                in_flight.popleft().wait()
+            results[id(nav)] = result = nav._api.apply_async(fetch_one, (nav,))
+            in_flight.append(result)
+        return [results[id(nav)].get() for nav in navigators]
+
     @restrict_to(methods='POST', templated=True)
     def create(self, *args, **kwargs):
         """Performs an HTTP POST to the server, to create source(s) """
@@ -521,4 +1303,31 @@ class HALNavigator(object):
     @restrict_to(methods='DELETE', templated=True)
     def delete(self, *args, **kwargs):
         """Performs an HTTP DELETE to the server, to delete resource(s)."""
-        return self._fetch_hal_and_create_resource(self.session.delete, *args, **kwargs)
\ No newline at end of file
+        return self._fetch_hal_and_create_resource(self.session.delete, *args, **kwargs)
+
+    def close(self):
+        """Stops the background threads of the api (they're shared by all of
+        its navigators), after waiting for outstanding background requests.
+        They're started again if another background request is made.
+
+        The threads are also stopped once all navigators of the api are
+        garbage collected, this is for when that needs to be deterministic"""
+        self._api.workers.close()
+
+    def get_async(self, raise_exc=True):
+        """Like get, but the request runs in the background on the api's
+        worker pool. Returns an AsyncResult; calling .get() on it waits for
+        the state (or re-raises the error)"""
+        return self._api.apply_async(self.get, (raise_exc,))
+
+    fetch_async = get_async
+
+    def create_async(self, *args, **kwargs):
+        """Like create, but runs in the background. Returns an AsyncResult"""
+        return self._api.apply_async(self.create, args, kwargs)
+
+    post_async = create_async
+
+    def delete_async(self, *args, **kwargs):
+        """Like delete, but runs in the background. Returns an AsyncResult"""
+        return self._api.apply_async(self.delete, args, kwargs)
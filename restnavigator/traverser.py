@@ -3,10 +3,11 @@ from pprint import pprint
 
 
 class HALTraversor(object):
-    def __init__(self, root_uri=None):
+    def __init__(self, root_uri=None, **navigator_options):
+        """`navigator_options` are passed on to the root HALNavigator"""
         if root_uri is None:
             raise 'Need to provide root uri to initialize a HALTraversor. e.g. HALTraversor("http://localhost:9077")'
-        self.navigator = HALNavigator(root_uri)
+        self.navigator = HALNavigator(root_uri, **navigator_options)
         self.template_parameters = None
         self.request_options_dict = None
         self.request_body = None
@@ -108,7 +109,7 @@ class HALTraversor(object):
                                 for alias, alias_conditions in conditions_dict.iteritems()}
         return self
 
-    def follow(self, *sequences):
+    def follow(self, *sequences, **kwargs):
         """
         :sequences - is a tuple of every sequence to be followed.
 
@@ -152,8 +153,47 @@ class HALTraversor(object):
                 request_options - See method 'with_request_options' for more details
                 conditions - See method 'with_conditions' for more details
 
+        :deadline - optional keyword argument, the number of seconds the whole
+            traversal may take. Each request gets the time that's left as its
+            timeout, and DeadlineExceeded is raised once it's used up.
+
         """
-        cursor = self.navigator
+        with self.navigator.deadline(kwargs.pop('deadline', None)):
+            path = self._path_key(sequences)
+            if path is None:
+                return self._follow(sequences)[0]
+            return self.navigator._resolve_path(
+                path, lambda: self._follow(sequences))
+
+    def _path_key(self, sequences):
+        """What identifies a traversal in the navigator's path cache, or None
+        if it can't be cached because it makes POST requests or changes
+        request options along the way"""
+        if self.request_options_dict is not None:
+            return None
+        rels = tuple(seq if isinstance(seq, basestring) else tuple(seq)
+                     for seq in sequences)
+        if any(not isinstance(seq, basestring) and 'post' in seq[1:]
+               for seq in rels):
+            return None
+        template_parameters = self.template_parameters or {}
+        try:
+            hash(tuple(template_parameters.items()))
+        except TypeError:
+            return None
+        return ('follow', rels, tuple(sorted(template_parameters.items())))
+
+    def _follow(self, sequences):
+        """Follows the sequences, returning where they lead and the
+        navigators whose links were followed.
+
+        When a rel has several links, the rest of the sequences is followed
+        from each of them, and a list of all the navigators reached is
+        returned (in the order of the links). The requests for each hop are
+        made concurrently on the api's worker pool"""
+        hops = []
+        cursors = [self.navigator]
+        fanned_out = False
         for seq in sequences:
 
             if isinstance(seq, basestring):
@@ -165,16 +205,43 @@ class HALTraversor(object):
             except IndexError:
                 method = None
 
-            cursor = cursor[rel_name]
-            if isinstance(cursor,HALNavigator):
-                if cursor.templated:
-                    cursor = cursor.expand(**self.template_parameters)
-                self.apply_request_options(method, rel_name)
-
-                if method == 'post':
-                    cursor = cursor.create({})
-
-        return cursor
+            self._fetch_all(cursors)
+            hops.extend(cursors)
+            following = []
+            for cursor in cursors:
+                cursor = cursor[rel_name]
+                if isinstance(cursor, list):
+                    fanned_out = True
+                    following.extend(cursor)
+                else:
+                    following.append(cursor)
+            cursors = [cursor.expand(**self.template_parameters)
+                       if cursor.templated else cursor
+                       for cursor in following]
+            self.apply_request_options(method, rel_name)
+
+            if method == 'post':
+                cursors = self._map(lambda cursor: cursor.create({}), cursors)
+
+        return (cursors if fanned_out else cursors[0]), hops
+
+    def _map(self, fn, navigators):
+        """Calls fn on each navigator, concurrently if there are several"""
+        if len(navigators) == 1:
+            return [fn(navigators[0])]
+        api = self.navigator._api
+        results = [api.apply_async(fn, (nav,)) for nav in navigators]
+        return [result.get() for result in results]
+
+    def _fetch_all(self, navigators):
+        """Fetches the navigators that haven't been yet, like indexing them
+        would, but concurrently"""
+        pending = {}
+        for nav in navigators:
+            if nav.idempotent and nav._needs_fetch:
+                pending[id(nav)] = nav
+        if len(pending) > 1:
+            self._map(lambda nav: nav.get(raise_exc=False), pending.values())
 
 if __name__ == '__main__':
     # T = HALTraversor('http://haltalk.herokuapp.com/')
@@ -3,11 +3,35 @@ from __future__ import print_function
 
 import urlparse
 import re
+import json
+import importlib
+import cgi
+import codecs
 import collections
 import itertools
+import functools
 import urllib
-
+import threading
+import time
+import decimal
+import random
+import email.utils
+from multiprocessing.pool import ThreadPool
+
+import requests
 import unidecode
+import uritemplate
+
+# ijson is optional, it's only needed to parse response bodies as a stream
+try:
+    import ijson.backends.yajl2_c as ijson
+except ImportError:  # pragma: nocover
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+if ijson is not None:
+    from ijson.common import ObjectBuilder, JSONError
 
 from restnavigator import exc, registry
 
@@ -71,6 +95,156 @@ def normalize_getitem_args(args):
     return rels, qargs, slug, ellipsis
 
 
+class LRUCache(object):
+    '''A thread safe mapping that only keeps the most recently used entries.
+
+    `maxsize` limits the number of entries, `max_weight` their total weight
+    (each entry has a weight given when it's set, 1 by default), and entries
+    older than `ttl` seconds are dropped. Any of these may be None.
+
+    Expired entries are dropped when they're looked up, and swept out from
+    time to time when entries are set. `on_expire`, if given, is called
+    with the value of each entry dropped because its ttl ran out.'''
+
+    # Entries are [prev, next, key, value, weight, expiry] links in a
+    # circular list whose root sits between the most and the least recently
+    # used entries
+
+    # Least number of seconds between two sweeps
+    SWEEP_INTERVAL = 1
+
+    def __init__(self, maxsize=None, max_weight=None, ttl=None,
+                 on_expire=None):
+        self.maxsize = maxsize
+        self.max_weight = max_weight
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.weight = 0
+        self._next_sweep = None
+        self._links = {}
+        self._root = root = []
+        root[:] = [root, root, None, None, 0, None]
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        link = self._links.get(key)
+        if link is None:
+            return default
+        with self._lock:
+            if self._links.get(key) is not link:  # evicted in the meantime
+                return default
+            if link[5] is not None and link[5] < time.time():
+                self._expire(link)
+                return default
+            self._unlink(link)
+            self._link_last(link)
+        return link[3]
+
+    def set(self, key, value, weight=1, ttl=None):
+        '''Stores value under key. `ttl` overrides the cache's ttl for this
+        entry'''
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expiry = None if ttl is None else now + ttl
+        with self._lock:
+            # a value replacing an expired one doesn't count as expiring
+            link = self._links.get(key)
+            if link is not None:
+                self._remove(link)
+            if self._next_sweep is not None and now >= self._next_sweep:
+                self._sweep(now)
+            if expiry is not None and (self._next_sweep is None or
+                                       expiry < self._next_sweep):
+                self._next_sweep = expiry
+            if self.max_weight is not None and weight > self.max_weight:
+                # Would evict everything else and still not fit
+                return
+            link = [None, None, key, value, weight, expiry]
+            self._link_last(link)
+            self._links[key] = link
+            self.weight += weight
+            root = self._root
+            while root[1] is not link and (
+                    (self.maxsize is not None
+                     and len(self._links) > self.maxsize) or
+                    (self.max_weight is not None
+                     and self.weight > self.max_weight)):
+                self._remove(root[1])
+
+    __setitem__ = set
+
+    def pop(self, key, default=None):
+        with self._lock:
+            link = self._links.get(key)
+            if link is None:
+                return default
+            self._remove(link)
+            return link[3]
+
+    def _sweep(self, now):
+        next_sweep = None
+        for link in self._links.values():
+            if link[5] is None:
+                continue
+            if link[5] < now:
+                self._expire(link)
+            elif next_sweep is None or link[5] < next_sweep:
+                next_sweep = link[5]
+        if next_sweep is not None:
+            next_sweep = max(next_sweep, now + self.SWEEP_INTERVAL)
+        self._next_sweep = next_sweep
+
+    def _expire(self, link):
+        self._remove(link)
+        if self.on_expire is not None:
+            self.on_expire(link[3])
+
+    def _remove(self, link):
+        self._unlink(link)
+        del self._links[link[2]]
+        self.weight -= link[4]
+
+    def _unlink(self, link):
+        prev, next_ = link[0], link[1]
+        prev[1] = next_
+        next_[0] = prev
+
+    def _link_last(self, link):
+        root = self._root
+        last = root[0]
+        link[0], link[1] = last, root
+        last[1] = root[0] = link
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def __len__(self):
+        return len(self._links)
+
+
+def memoized(maxsize):
+    '''Decorator that caches the results of a function of one (hashable)
+    argument, for the `maxsize` most recently used arguments'''
+
+    def wrap(fn):
+        cache = LRUCache(maxsize)
+        missing = object()
+
+        @functools.wraps(fn)
+        def wrapped(arg):
+            result = cache.get(arg, missing)
+            if result is missing:
+                result = cache[arg] = fn(arg)
+            return result
+
+        wrapped.cache = cache
+        wrapped.uncached = fn
+        return wrapped
+
+    return wrap
+
+
+@memoized(maxsize=1024)
 def namify(root_uri):
     '''Turns a root uri into a less noisy representation that will probably
     make sense in most circumstances. Used by Navigator's __repr__, but can be
@@ -145,17 +319,26 @@ def namify(root_uri):
     )
 
 
+# Marks a LinkList row that doesn't have a property
+_MISSING = object()
+
+
 class LinkList(list):
     '''A list subclass that offers different ways of grabbing the values based
     on various metadata stored for each entry in the dictionary.
 
+    The metadata is stored by column (one list of values per property). The
+    index for a property is only built the first time it's queried.
+
     Note: Removing items from this list isn't really the point, so no attempt
     has been made to make this convenient. Deleting items will not remove them
     from the list's metadata.'''
 
     def __init__(self, items=None):
         super(LinkList, self).__init__()
-        self._meta = {}
+        self._rows = []  # the items added with append_with, in order
+        self._columns = {}  # property -> value for each row (or _MISSING)
+        self._indexes = {}  # property -> serialized value -> row numbers
         items = items or []
         for obj, properties in items:
             self.append_with(obj, **properties)
@@ -165,47 +348,634 @@ class LinkList(list):
 
     def append_with(self, obj, **properties):
         '''Add an item to the dictionary with the given metadata properties'''
+        row = len(self._rows)
         for prop, val in properties.iteritems():
-            val = self.serialize(val)
-            self._meta.setdefault(prop, {}).setdefault(val, []).append(obj)
+            column = self._columns.get(prop)
+            if column is None:
+                column = self._columns[prop] = [_MISSING] * row
+            column.append(val)
+        for column in self._columns.itervalues():
+            if len(column) == row:
+                column.append(_MISSING)
+        self._rows.append(obj)
+        for prop, index in self._indexes.iteritems():
+            val = self._columns[prop][row]
+            if val is not _MISSING:
+                index.setdefault(self.serialize(val), []).append(row)
         self.append(obj)
 
+    def _index(self, prop):
+        '''Returns the index for a property, building it if necessary'''
+        index = self._indexes.get(prop)
+        if index is None:
+            index = {}
+            for row, val in enumerate(self._columns.get(prop, ())):
+                if val is not _MISSING:
+                    index.setdefault(self.serialize(val), []).append(row)
+            self._indexes[prop] = index
+        return index
+
     def get_by(self, prop, val):
         '''Retrieve an item from the dictionary with the given metadata
         properties. If there is no such item, None will be returned, if there
         are multiple such items, the first will be returned.'''
-        try:
-            val = self.serialize(val)
-            return self._meta[prop][val][0]
-        except (KeyError, IndexError):
-            return None
+        rows = self._index(prop).get(self.serialize(val))
+        return self._rows[rows[0]] if rows else None
 
     def getall_by(self, prop, val):
         '''Retrieves all items from the dictionary with the given metadata'''
-        try:
-            val = self.serialize(val)
-            return self._meta[prop][val][:]  # return a copy of the list
-        except KeyError:
-            return []
+        rows = self._index(prop).get(self.serialize(val), [])
+        return [self._rows[row] for row in rows]
 
     def named(self, name):
         '''Returns .get_by('name', name)'''
         name = self.serialize(name)
         return self.get_by('name', name)
 
+    def filter(self, **properties):
+        '''Retrieves all items matching every one of the given properties,
+        in order. A property's value can also be a predicate, which is called
+        with the item's value for that property (items that don't have the
+        property never match):
+
+            links.filter(type='text/html', name=lambda n: n.startswith('a'))
+        '''
+        rows = None
+        for prop, val in properties.iteritems():
+            if callable(val):
+                matching = set(
+                    row for row, v in enumerate(self._columns.get(prop, ()))
+                    if v is not _MISSING and val(v))
+            else:
+                matching = set(
+                    self._index(prop).get(self.serialize(val), ()))
+            rows = matching if rows is None else rows & matching
+            if not rows:
+                return []
+        if rows is None:
+            return self._rows[:]
+        return [self._rows[row] for row in sorted(rows)]
+
 
 class LinkDict(dict):
     '''dict subclass that allows specifying a default curie. This
-    enables multiple ways to access an item'''
+    enables multiple ways to access an item
 
-    def __init__(self, default_curie, d):
+    Short rel names are resolved through an index built up front, so a
+    lookup is a single dict access. A short name resolves to:
+      - the IANA registered rel of that name, if there is one in the dict
+      - otherwise the rel with the default curie
+      - otherwise the rel itself
+      - otherwise the rel with one of the `curies` declared in the document,
+        if exactly one of them has a rel of that name'''
+
+    def __init__(self, default_curie, d, curies=()):
         super(LinkDict, self).__init__(d)
         self.default_curie = default_curie
+        self._curies = frozenset(curies)
+        self._build_index()
+
+    def _build_index(self):
+        index = {}
+        by_other_curie = {}
+        for key in self:
+            curie, sep, name = key.partition(':')
+            if (sep and ':' not in name and curie in self._curies
+                    and curie != self.default_curie):
+                by_other_curie.setdefault(name, []).append(key)
+        for name, keys in by_other_curie.iteritems():
+            if len(keys) == 1:
+                index[name] = keys[0]
+        for key in self:
+            index[key] = key
+        if self.default_curie is not None:
+            for key in self:
+                curie, sep, name = key.partition(':')
+                if (sep and curie == self.default_curie and ':' not in name
+                        and not (name in self and name in registry.iana_rels)):
+                    index[name] = key
+        self._index = index
+
+    def resolve(self, rel):
+        '''Returns the full rel that looking up `rel` would return'''
+        return self._index.get(rel, rel)
+
+    @property
+    def resolutions(self):
+        '''The mapping of every name that can be looked up to its full rel'''
+        return dict(self._index)
 
     def __getitem__(self, key):
-        if (':' in key
-            or (key in self and key in registry.iana_rels)
-            or self.default_curie is None):
-            return super(LinkDict, self).__getitem__(key)
-        implicit_key = '{}:{}'.format(self.default_curie, key)
-        return super(LinkDict, self).__getitem__(implicit_key)
+        return super(LinkDict, self).__getitem__(self._index.get(key, key))
+
+    def __setitem__(self, key, value):
+        is_new = key not in self
+        super(LinkDict, self).__setitem__(key, value)
+        if is_new:
+            self._build_index()
+
+
+class WorkerPool(object):
+    '''A bounded pool of worker threads that isn't started until the first
+    job is submitted. One pool is shared by all Navigators of an api, so the
+    number of requests in flight never exceeds its size.
+
+    The threads are stopped by close(), or when the WorkerPool is garbage
+    collected.'''
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('A WorkerPool needs at least one worker')
+        self.size = size
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def apply_async(self, fn, args=(), kwargs=None):
+        '''Runs fn(*args, **kwargs) on a worker. Returns an AsyncResult'''
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.size)
+        return self._pool.apply_async(fn, args, kwargs or {})
+
+    def close(self, wait=True):
+        '''Stops the worker threads once outstanding jobs are done, waiting
+        for that if `wait`. Submitting a job afterwards starts new ones'''
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            if wait:
+                pool.join()
+
+    def __del__(self):
+        # The pool's own threads keep it alive, so it has to be told to stop
+        if self._pool is not None:
+            self._pool.close()
+
+
+def freshness_lifetime(response, default):
+    '''How many more seconds a response may be considered fresh, following
+    its Cache-Control, Expires and Age headers. `default` is used when it
+    doesn't say. Error responses are never fresh'''
+    if response is None:
+        return default
+    if not response.ok:
+        return 0
+    headers = response.headers
+    directives = {}
+    for directive in headers.get('Cache-Control', '').split(','):
+        name, _, value = directive.strip().partition('=')
+        directives[name.lower()] = value.strip('"')
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    age = parse_retry_after(headers.get('Age')) or 0
+    if directives.get('max-age', '').isdigit():
+        return int(directives['max-age']) - age
+    expires = headers.get('Expires')
+    if expires is not None:
+        expires = email.utils.parsedate_tz(expires)
+        date = email.utils.parsedate_tz(headers.get('Date', ''))
+        if expires is None:
+            return 0  # an invalid Expires means already expired
+        now = time.time() if date is None else email.utils.mktime_tz(date)
+        return email.utils.mktime_tz(expires) - now - age
+    return default
+
+
+class Metrics(object):
+    '''Counters for the requests made to an api, cheap enough to be always
+    on:
+
+      requests          responses received, by (method, status), whether
+                        from the server or the http cache
+      network_requests  requests that went to the server
+      errors            requests that failed without a response
+      cache_hits        responses served from the http cache without
+                        contacting the server
+      revalidations     responses confirmed still valid by the server (304)
+      id_map_hits       links that led to a navigator already in the
+                        identity map
+      id_map_misses     links that led to a new navigator
+      autofetches       requests made implicitly, by accessing a navigator
+                        that wasn't fetched yet
+      bytes_received    size of the response bodies sent by the server
+      cache_bytes       size of the response bodies served from the cache
+      parse_time        seconds spent parsing response bodies'''
+
+    FIELDS = ('network_requests', 'errors', 'cache_hits', 'revalidations',
+              'id_map_hits', 'id_map_misses', 'autofetches', 'bytes_received',
+              'cache_bytes', 'parse_time')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''Sets all counters back to zero. Returns a snapshot of what they
+        were'''
+        with self._lock:
+            old = self._copy()
+            self.requests = collections.Counter()
+            for field in self.FIELDS:
+                setattr(self, field, 0)
+        return old
+
+    def snapshot(self):
+        '''A copy of the counters as they are now'''
+        with self._lock:
+            return self._copy()
+
+    def _copy(self):
+        copy = Metrics.__new__(Metrics)
+        copy._lock = threading.Lock()
+        copy.requests = collections.Counter(getattr(self, 'requests', {}))
+        for field in self.FIELDS:
+            setattr(copy, field, getattr(self, field, 0))
+        return copy
+
+    def as_dict(self):
+        '''The counters as a plain dict, with requests keyed by
+        "METHOD status" strings'''
+        with self._lock:
+            d = {field: getattr(self, field) for field in self.FIELDS}
+            d['requests'] = {'{} {}'.format(method, status): count
+                             for (method, status), count
+                             in self.requests.iteritems()}
+        d['total_requests'] = sum(d['requests'].itervalues())
+        return d
+
+    def __repr__(self):
+        return 'Metrics({!r})'.format(self.as_dict())
+
+    def add(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def record_response(self, method, response, size):
+        '''Counts a response that was received. A cached response the server
+        revalidated is only told apart from a cache hit by the `revalidated`
+        attribute restnavigator.cache.CacheAdapter sets'''
+        from_cache = getattr(response, 'from_cache', False)
+        revalidated = response.status_code == 304 or \
+            getattr(response, 'revalidated', False)
+        with self._lock:
+            self.requests[method, response.status_code] += 1
+            self._add_bytes(from_cache, size)
+            if from_cache and not revalidated:
+                self.cache_hits += 1
+            else:
+                self.network_requests += 1
+                if revalidated:
+                    self.revalidations += 1
+
+
+    def record_body(self, response, size):
+        '''Counts the size of a response body that was only known once it
+        had been read, for a response record_response was given 0 for'''
+        with self._lock:
+            self._add_bytes(getattr(response, 'from_cache', False), size)
+
+    def _add_bytes(self, from_cache, size):
+        if from_cache:
+            self.cache_bytes += size
+        else:
+            self.bytes_received += size
+
+
+class HookEvent(object):
+    '''What request hooks are called with. One event follows a request
+    through all of its hooks, attributes that aren't known yet when a hook
+    is called are None.
+
+    `name` is the hook being called, `nav` the navigator making the request,
+    `rel` the rel that navigator was first linked by, `bytes` the size of
+    the response body, `network_time` and `parse_time` are in seconds, and
+    `error` is the exception for on_error hooks'''
+
+    __slots__ = ('name', 'nav', 'uri', 'method', 'rel', 'status', 'bytes',
+                 'network_time', 'parse_time', 'error')
+
+    def __init__(self, nav, method=None):
+        self.name = None
+        self.nav = nav
+        self.uri = nav.uri
+        self.method = method
+        self.rel = nav.rel
+        self.status = None
+        self.bytes = None
+        self.network_time = None
+        self.parse_time = None
+        self.error = None
+
+    def __repr__(self):
+        return 'HookEvent({0.name}, {0.method} {0.uri}, status={0.status})'\
+            .format(self)
+
+
+class Deadline(object):
+    '''A point in time by which a sequence of requests has to be done'''
+
+    def __init__(self, seconds):
+        self.expires = time.time() + seconds
+
+    def remaining(self):
+        '''Seconds left until the deadline, negative once it's passed'''
+        return self.expires - time.time()
+
+    def cap(self, timeout):
+        '''Limits a requests timeout (None, seconds, or a (connect, read)
+        tuple) to the time that's left'''
+        remaining = max(self.remaining(), 0)
+        if isinstance(timeout, tuple):
+            return tuple(remaining if t is None else min(t, remaining)
+                         for t in timeout)
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+class RetryPolicy(object):
+    '''Decides whether and when a failed request is sent again.
+
+    A request is retried when sending it raises a connection error or a
+    timeout, or when the response status is in `statuses`, but only if its
+    method is in `methods`. By default those are the idempotent methods, so
+    a POST is never sent twice. At most `max_attempts` requests are made.
+
+    Between attempts it waits an exponentially growing delay, `backoff`
+    seconds after the first attempt and at most `max_backoff`. With `jitter`
+    a random delay up to that is used instead, so clients that failed
+    together don't retry together. A Retry-After header in the response
+    overrides the delay (still capped by `max_backoff`).'''
+
+    STATUSES = frozenset([429, 502, 503, 504])
+    METHODS = frozenset(['GET', 'HEAD', 'DELETE'])
+
+    def __init__(self, max_attempts=3, backoff=0.5, max_backoff=30,
+                 jitter=True, statuses=STATUSES, methods=METHODS):
+        if max_attempts < 1:
+            raise ValueError('A RetryPolicy needs at least one attempt')
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.statuses = frozenset(statuses)
+        self.methods = frozenset(m.upper() for m in methods)
+
+    def __repr__(self):
+        return 'RetryPolicy(max_attempts={!r}, methods={!r})'.format(
+            self.max_attempts, sorted(self.methods))
+
+    def call(self, method, send, deadline=None):
+        '''Calls send() until it returns a response that shouldn't be
+        retried, or the attempts run out. Returns the last response, or
+        re-raises the last error.
+
+        With a `deadline`, it also stops retrying when waiting for the next
+        attempt would take longer than the time that's left'''
+        retriable = method.upper() in self.methods
+        attempt = 1
+        while True:
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout):
+                if not retriable or attempt >= self.max_attempts:
+                    raise
+                delay = self.delay(attempt)
+                if deadline is not None and delay >= deadline.remaining():
+                    raise
+            else:
+                if not retriable or attempt >= self.max_attempts or \
+                        response.status_code not in self.statuses:
+                    return response
+                delay = self.delay(attempt, response)
+                if deadline is not None and delay >= deadline.remaining():
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def delay(self, attempt, response=None):
+        '''The number of seconds to wait after the given (1 based) failed
+        attempt'''
+        retry_after = None
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return random.uniform(0, delay) if self.jitter else delay
+
+
+def parse_retry_after(value):
+    '''Parses a Retry-After header, which is either a number of seconds or
+    an HTTP date, into seconds from now. Returns None if it can't'''
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    date = email.utils.parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0, email.utils.mktime_tz(date) - time.time())
+
+
+def json_body(content, content_type=None):
+    '''Prepares a raw response body for a JSON decoder. The bytes are
+    decoded with the charset from the Content-Type header if there is one,
+    otherwise they're passed on as UTF-8 (which JSON requires), so there's no
+    need for the charset detection requests does for response.text'''
+    charset = cgi.parse_header(content_type or '')[1].get('charset', '')
+    if charset.lower().replace('-', '') not in ('', 'utf8'):
+        try:
+            return content.decode(charset)
+        except LookupError:
+            pass  # not a charset python knows, so try it as UTF-8
+    if content.startswith(codecs.BOM_UTF8):
+        return content[len(codecs.BOM_UTF8):]
+    return content
+
+
+# CompiledTemplate builds its expansion plan from the internals of
+# uritemplate 0.6. With any other version it leaves expansion to uritemplate
+_URITEMPLATE_INTERNALS = (
+    getattr(uritemplate, '__version__', None) == '0.6' and
+    all(hasattr(uritemplate, name)
+        for name in ('TEMPLATE', 'OPERATOR', 'RESERVED', 'TOSTRING')))
+
+
+class CompiledTemplate(object):
+    '''A uri template that has been parsed once, so that its variables and
+    the plan for expanding it don't have to be worked out on every use.
+    Expands exactly like uritemplate.expand.
+
+    The plan is only built by the first expand(), so a template uritemplate
+    can't expand only raises then, as it would with uritemplate.expand.'''
+
+    def __init__(self, template):
+        self.template = template
+        self.variables = frozenset(uritemplate.variables(template))
+        self._expand = None
+
+    def _compile(self):
+        '''Returns a function that expands the template with a dict of
+        variables'''
+        if hasattr(uritemplate, 'URITemplate'):
+            # newer versions of uritemplate can compile templates themselves
+            return uritemplate.URITemplate(self.template).expand
+        if not _URITEMPLATE_INTERNALS:
+            return functools.partial(uritemplate.expand, self.template)
+        # TEMPLATE.split alternates literal text and expressions
+        pieces = uritemplate.TEMPLATE.split(self.template)
+        plan = [piece if i % 2 == 0 else self._compile_expression(piece)
+                for i, piece in enumerate(pieces)]
+        return functools.partial(self._expand_plan, plan)
+
+    @staticmethod
+    def _compile_expression(expression):
+        operator = ''
+        varlist = expression
+        if expression[0] in uritemplate.OPERATOR:
+            operator, varlist = expression[0], expression[1:]
+        safe = uritemplate.RESERVED if operator in ('+', '#') else ''
+        varspecs = []
+        defaults = {}
+        for varspec in varlist.split(','):
+            explode = False
+            prefix = None
+            varname, _, default = varspec.partition('=')
+            if varname[-1] == '*':
+                explode = True
+                varname = varname[:-1]
+            elif ':' in varname:
+                varname, _, prefix = varname.partition(':')
+                try:
+                    prefix = int(prefix)
+                except ValueError:
+                    raise ValueError(
+                        "non-integer prefix '{0}'".format(prefix))
+            if default:
+                defaults[varname] = default
+            varspecs.append((varname, explode, prefix))
+        start, joiner = {
+            '+': ('', ','),
+            '#': ('#', ','),
+            '?': ('?', '&'),
+            '&': ('&', '&'),
+            '': ('', ','),
+        }.get(operator, (operator, operator))
+        return (uritemplate.TOSTRING[operator], operator, safe, start, joiner,
+                varspecs, defaults)
+
+    def expand(self, variables):
+        expand = self._expand
+        if expand is None:
+            expand = self._expand = self._compile()
+        return expand(variables)
+
+    @staticmethod
+    def _expand_plan(plan, variables):
+        out = []
+        for piece in plan:
+            if isinstance(piece, basestring):
+                out.append(piece)
+                continue
+            tostring, operator, safe, start, joiner, varspecs, defaults = piece
+            expanded = []
+            for varname, explode, prefix in varspecs:
+                if varname in variables:
+                    value = variables[varname]
+                    if not value and value != '' and varname in defaults:
+                        value = defaults[varname]
+                elif varname in defaults:
+                    value = defaults[varname]
+                else:
+                    continue
+                value = tostring(
+                    varname, value, explode, prefix, operator, safe=safe)
+                if value is not None:
+                    expanded.append(value)
+            if expanded:
+                out.append(start + joiner.join(expanded))
+        return ''.join(out)
+
+
+class JSONCodec(object):
+    '''Decodes and encodes JSON for Navigators.
+
+    `module` is anything with loads and dumps functions like the json
+    module's (e.g. simplejson or ujson), or the name of such a module. If
+    the named module can't be imported, the stdlib json module is used.'''
+
+    def __init__(self, module=None):
+        if isinstance(module, basestring):
+            try:
+                module = importlib.import_module(module)
+            except ImportError:
+                module = None
+        self.module = json if module is None else module
+        self.loads = self.module.loads
+        # Some encoders don't take separators, but are compact anyway
+        try:
+            self.module.dumps({}, separators=(',', ':'))
+            self._compact = {'separators': (',', ':')}
+        except TypeError:
+            self._compact = {}
+
+    def dumps(self, obj, cls=None):
+        '''Compactly encodes obj. A JSONEncoder subclass given as `cls` is
+        a stdlib json feature, so the stdlib does the encoding then.'''
+        if cls is not None:
+            return json.dumps(obj, cls=cls, separators=(',', ':'))
+        return self.module.dumps(obj, **self._compact)
+
+
+class IterStream(object):
+    '''A minimal read-only file object over an iterator of byte chunks'''
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            try:
+                self._buf += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self._buf = self._buf, b''
+        else:
+            data, self._buf = self._buf[:size], self._buf[size:]
+        return data
+
+
+class ByteCounter(object):
+    '''Passes an iterator of byte chunks through, counting how many bytes
+    went by in `count`'''
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        chunk = next(self._chunks)
+        self.count += len(chunk)
+        return chunk
+
+
+def load_json_stream(chunks):
+    '''Parses JSON from an iterable of byte chunks as they arrive, without
+    ever joining them into one string. Numbers come out the same as from
+    json.loads. Raises ValueError on invalid JSON. Requires ijson.'''
+    builder = ObjectBuilder()
+    try:
+        for event, value in ijson.basic_parse(IterStream(chunks)):
+            if event == 'number' and isinstance(value, decimal.Decimal):
+                value = float(value)
+            builder.event(event, value)
+    except JSONError as e:
+        raise ValueError(unicode(e))
+    return builder.value
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+'''Benchmarks HALNavigator.__repr__ and utils.namify with and without their
+caches. Run from the root of the source directory:
+
+    $ python scripts/bench_repr.py
+
+'''
+
+from __future__ import print_function
+
+import timeit
+
+from restnavigator import HALNavigator, utils
+
+ROOT = 'http://api.example.com/v2/'
+NUMBER = 20000
+
+
+def per_call(stmt, number=NUMBER):
+    '''Microseconds per call of stmt, best of three runs'''
+    return min(timeit.repeat(stmt, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    N = HALNavigator(ROOT)
+    navs = [N._make_nav(uri=ROOT + 'users/ko%C5%BEu%C5%A1%C4%8Dek/posts/' +
+                        str(i))
+            for i in xrange(100)]
+
+    def repr_cached():
+        for nav in navs:
+            repr(nav)
+
+    def repr_uncached():
+        for nav in navs:
+            nav._make_repr()
+
+    results = [
+        ('repr (uncached)', per_call(repr_uncached, NUMBER // 100) / 100),
+        ('repr (cached)', per_call(repr_cached, NUMBER // 100) / 100),
+        ('namify (uncached)', per_call(lambda: utils.namify.uncached(ROOT))),
+        ('namify (cached)', per_call(lambda: utils.namify(ROOT))),
+    ]
+    for name, usec in results:
+        print('{:<20}{:>8.2f} usec/call'.format(name, usec))
+
+
+if __name__ == '__main__':
+    main()
@@ -33,6 +33,9 @@ setup(
                       "Unidecode>=0.04.14",
                       "CacheControl>=0.10.4",
                       ],
+    extras_require={
+        'stream': ["ijson>=2.0"],
+    },
     tests_require=[
         "httpretty==0.6.0",
         "pytest>=2.3.5, <2.6",
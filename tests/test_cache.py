@@ -0,0 +1,75 @@
+from __future__ import print_function
+
+import json
+import os
+from email.utils import formatdate
+
+import httpretty
+
+import restnavigator.halnav as HN
+from restnavigator.cache import SQLiteCache
+
+
+def test_SQLiteCache__persists(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    cache = SQLiteCache(path)
+    cache.set('http://example.com/', b'\x00response')
+    assert cache.get('http://example.com/') == b'\x00response'
+    assert cache.get('http://example.com/missing') is None
+    cache.close()
+
+    reopened = SQLiteCache(path)
+    assert reopened.get('http://example.com/') == b'\x00response'
+    reopened.delete('http://example.com/')
+    assert reopened.get('http://example.com/') is None
+
+
+def test_SQLiteCache__evicts_least_recently_used(tmpdir):
+    cache = SQLiteCache(str(tmpdir.join('cache.sqlite')), max_bytes=30,
+                        touch_interval=0)
+    cache.set('a', b'x' * 10)
+    cache.set('b', b'x' * 10)
+    cache.set('c', b'x' * 10)
+    cache.get('a')
+    cache.set('d', b'x' * 10)
+    assert cache.get('b') is None
+    assert [cache.get(k) is not None for k in 'acd'] == [True, True, True]
+    cache.set('huge', b'x' * 31)
+    assert cache.get('huge') is None
+
+
+def test_SQLiteCache__running_total_and_rare_touches(tmpdir):
+    cache = SQLiteCache(str(tmpdir.join('cache.sqlite')))
+    db = cache._connection()
+    total = lambda: db.execute('SELECT size FROM totals').fetchone()[0]
+    cache.set('a', b'x' * 10)
+    cache.set('a', b'x' * 4)
+    cache.set('b', b'x' * 5)
+    cache.delete('b')
+    assert total() == 4
+    used = lambda: db.execute('SELECT used FROM responses').fetchone()[0]
+    before = used()
+    changes = db.total_changes
+    cache.get('a')
+    assert (used(), db.total_changes) == (before, changes)
+
+
+def test_HALNavigator__cache_path(tmpdir):
+    path = str(tmpdir.join('cache.sqlite'))
+    index_uri = 'http://www.example.com/'
+    httpretty.HTTPretty.reset()
+    httpretty.HTTPretty.enable()
+    try:
+        responses = [httpretty.Response(body=json.dumps({'version': v}),
+                                        content_type='application/hal+json',
+                                        cache_control='max-age=3600',
+                                        date=formatdate(usegmt=True))
+                     for v in (1, 2)]
+        httpretty.HTTPretty.register_uri('GET', index_uri, responses=responses)
+        N = HN.HALNavigator(index_uri, cache=path)
+        assert N.fetch()['version'] == 1
+        N2 = HN.HALNavigator(index_uri, cache=path)
+        assert N2.fetch()['version'] == 1
+    finally:
+        httpretty.HTTPretty.disable()
+    assert os.path.getsize(path) > 0
@@ -4,14 +4,21 @@ import httpretty
 import json
 import pytest
 import re
+import collections
 import contextlib
+import gc
 import random
 import string
+import threading
+import time
 
 import uritemplate
 import requests.auth
+from restnavigator import exc
 from restnavigator.exc import InvalidOperation
+from restnavigator.traverser import HALTraversor
 
+import restnavigator
 import restnavigator.halnav as HN
 
 # pylint: disable-msg=E1101
@@ -268,6 +275,20 @@ def test_HALNavigator__expand():
         assert half_expanded.template_args == dict(x=1, y=2)
 
 
+def test_HALNavigator__bad_template_only_fails_on_expand():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'bad': {'href': index_uri + 's{|x}',
+                                         'templated': True}})
+
+        N = HN.HALNavigator(index_uri)
+        bad = N['bad']
+        assert bad.templated
+        assert bad.parameters == set(['x'])
+        with pytest.raises(KeyError):
+            bad.expand(x=1)
+
+
 def test_HALNavigator__dont_get_template_links():
     with httprettify():
         index_uri = 'http://www.example.com/'
@@ -886,3 +907,836 @@ def test_HALNavigator__default_curie_iana_conflict(reltest_links):
         N = HN.HALNavigator(index_uri, curie="xx")
 
         assert N['next'] is N['xx:next']
+
+
+def test_HALNavigator__embedded_resources_are_hydrated():
+    with httprettify() as HTTPretty:
+        index_uri = 'http://www.example.com/'
+        post_uri = index_uri + 'posts/1'
+        author_uri = index_uri + 'users/fred'
+        embedded = {
+            'ht:post': {
+                '_links': {'self': {'href': '/posts/1', 'title': 'First'},
+                           'ht:author': {'href': author_uri}},
+                'content': 'embedded content',
+            },
+            'ht:comments': [
+                {'_links': {'self': {'href': '/comments/' + str(i),
+                                     'name': 'c' + str(i)}},
+                 'text': 'comment ' + str(i)}
+                for i in xrange(3)
+            ],
+            'ht:anonymous': {'text': 'no self link'},
+        }
+        register_hal(index_uri,
+                     links={'ht:post': {'href': post_uri}},
+                     state={'_embedded': embedded})
+        register_hal(post_uri, state={'content': 'fetched content'})
+
+        N = HN.HALNavigator(index_uri)
+        N()
+        post = N['ht:post']
+        assert post.uri == post_uri
+        assert post.title == 'First'
+        assert post.state['content'] == 'embedded content'
+        assert post.links['ht:author'].uri == author_uri
+        assert HTTPretty.last_request.path == '/'
+        assert post is N.links['ht:post']
+        comments = N['ht:comments']
+        assert [c.state['text'] for c in comments] == \
+            ['comment 0', 'comment 1', 'comment 2']
+        assert N.links['ht:comments'].named('c1') is comments[1]
+        assert 'ht:anonymous' not in N.links
+        assert HTTPretty.last_request.path == '/'
+        assert post.fetch()['content'] == 'fetched content'
+
+
+def test_HALNavigator__embedded_resources_survive_gc():
+    with httprettify() as HTTPretty:
+        index_uri = 'http://www.example.com/'
+        post_uri = index_uri + 'posts/1'
+        register_hal(index_uri,
+                     links={'ht:post': {'href': post_uri}},
+                     state={'_embedded': {'ht:post': {
+                         '_links': {'self': {'href': post_uri}},
+                         'content': 'embedded content'}}})
+        register_hal(post_uri, state={'content': 'fetched content'})
+
+        N = HN.HALNavigator(index_uri)
+        N()
+        gc.collect()  # nothing outside N references the embedded navigator
+        assert N['ht:post'].state['content'] == 'embedded content'
+        assert HTTPretty.last_request.path == '/'
+
+
+def test_HALNavigator__links_built_on_first_use():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'next': {'href': index_uri + 'next'}})
+        register_hal(index_uri + 'next', {})
+        N = HN.HALNavigator(index_uri)
+        N.fetch()
+        assert N._api.id_map.get(index_uri + 'next') is None
+        links = N._links
+        assert N._links is links
+        assert N._api.id_map.get(index_uri + 'next') is links['next']
+        # the values are real navigators, even to dict's own C code
+        assert type(dict(links)['next']) is HN.HALNavigator
+        copied = {}
+        copied.update(links)
+        assert copied['next'] is links['next']
+        assert (lambda **kw: kw)(**links)['next'] is links['next']
+
+
+def test_HALNavigator__refetch_reuses_fetched_links():
+    with httprettify() as HTTPretty:
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'next': {'href': index_uri + 'next'}})
+        register_hal(index_uri + 'next', {})
+        N = HN.HALNavigator(index_uri)
+        child = N['next']
+        child.fetch()
+        del child
+        N.fetch()
+        gc.collect()
+        requests_made = len(HTTPretty.latest_requests)
+        assert N['next'].response is not None
+        assert len(HTTPretty.latest_requests) == requests_made
+
+
+def test_HALNavigator__embedded_resources_dont_overwrite_fetched():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        post_uri = index_uri + 'posts/1'
+        register_hal(index_uri,
+                     links={'ht:post': {'href': post_uri}},
+                     state={'_embedded': {'ht:post': {
+                         '_links': {'self': {'href': post_uri}},
+                         'partial': True}}})
+        register_hal(post_uri, state={'full': True})
+
+        N = HN.HALNavigator(index_uri)
+        post = N['ht:post']
+        assert post.fetch() == {'full': True}
+        N.fetch()
+        assert N['ht:post'] is post
+        assert post.state == {'full': True}
+
+
+def test_HALNavigator__embedded_resources_follow_refetches():
+    with httprettify() as HTTPretty:
+        index_uri = 'http://www.example.com/'
+        post_uri = index_uri + 'posts/1'
+        server = {'v': 1}
+
+        def callback(request, uri, headers):
+            body = {'_links': {'self': {'href': uri},
+                               'ht:post': {'href': post_uri}},
+                    '_embedded': {'ht:post': {
+                        '_links': {'self': {'href': post_uri}},
+                        'v': server['v']}}}
+            return 200, {'server': 'HTTPretty 0.6.0'}, json.dumps(body)
+        HTTPretty.register_uri('GET', index_uri, body=callback)
+
+        N = HN.HALNavigator(index_uri)
+        post = N['ht:post']
+        assert post.state == {'v': 1}
+        server['v'] = 2
+        N.fetch()
+        assert N['ht:post'] is post
+        assert post.state == {'v': 2}
+
+
+def test_HALNavigator__embedded_list_skips_self():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, state={'_embedded': {'item': [
+            {'_links': {'self': {'href': index_uri}}},
+            {'_links': {'self': {'href': index_uri + 'x'}}, 'x': True},
+            {'no_self_link': True}]}})
+
+        N = HN.HALNavigator(index_uri)
+        assert [(item.uri, item.state) for item in N['item']] == \
+            [(index_uri + 'x', {'x': True})]
+
+
+def test_HALNavigator__get_async():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        index_links = {'item': [{'href': index_uri + 'items/' + str(i)}
+                                for i in xrange(4)],
+                       'missing': {'href': index_uri + 'missing'}}
+        register_hal(index_uri, index_links)
+        for i in xrange(4):
+            register_hal(index_uri + 'items/' + str(i), state={'id': i})
+        register_hal(index_uri + 'missing', status=404)
+
+        N = HN.HALNavigator(index_uri, max_workers=2)
+        items = N['item']
+        results = [item.get_async() for item in items]
+        assert [r.get(timeout=5)['id'] for r in results] == range(4)
+        assert all(item.response is not None for item in items)
+        with pytest.raises(HN.HALNavigatorError):
+            N['missing'].fetch_async().get(timeout=5)
+        N.close()
+        assert N._api.workers._pool is None
+
+
+def test_HALNavigator__worker_threads_stop_when_collected():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {})
+        threads = threading.active_count()
+        for _ in range(3):
+            N = HN.HALNavigator(index_uri, max_workers=4)
+            N.get_async().get(timeout=5)
+        del N
+        gc.collect()
+        for _ in range(100):
+            if threading.active_count() <= threads:
+                break
+            time.sleep(0.05)
+        assert threading.active_count() <= threads
+
+
+def test_HALNavigator__prefetch():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {
+            'item': [{'href': index_uri + 'items/' + str(i)}
+                     for i in xrange(3)],
+            'about': {'href': index_uri + 'about'},
+            'search': {'href': index_uri + 'search{?q}', 'templated': True},
+        })
+        for i in xrange(3):
+            register_hal(index_uri + 'items/' + str(i),
+                         {'owner': {'href': index_uri + 'owners/' + str(i)},
+                          'up': {'href': index_uri}},
+                         state={'id': i})
+            register_hal(index_uri + 'owners/' + str(i),
+                         {'next': {'href': index_uri + 'far'}})
+        register_hal(index_uri + 'about')
+
+        N = HN.HALNavigator(index_uri)
+        fetched = N.prefetch(rels=['item', 'owner'], depth=2)
+        items = N['item']
+        owners = [item['owner'] for item in items]
+        assert fetched == items + owners
+        assert all(nav.response is not None for nav in fetched)
+        assert [item.state['id'] for item in items] == [0, 1, 2]
+        assert N['about'].response is None
+        assert owners[0]['next'].response is None
+
+        fetched = N.prefetch()
+        assert fetched == [N['about']]
+        assert N['search'].response is None
+
+
+@pytest.mark.parametrize('read_ahead', [0, 1, 3, 20])
+def test_HALNavigator__iterate_read_ahead(read_ahead):
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        for i in xrange(1, 11):
+            page_links = {}
+            if i < 10:
+                page_links = {'next': {'href': index_uri + str(i + 1)}}
+            register_hal(index_uri + str(i), page_links, state={'page': i})
+
+        N = HN.HALNavigator(index_uri + '1')
+        pages = [nav() for nav in N.iterate(read_ahead=read_ahead)]
+        assert [page['page'] for page in pages] == range(1, 11)
+
+        for i, nav in enumerate(N.iterate(read_ahead=read_ahead), start=1):
+            if i == 4:
+                break
+        assert nav.uri == index_uri + '4'
+
+
+def test_HALNavigator__fetch_many():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        index_links = {'item': [{'href': index_uri + 'items/' + str(i)}
+                                for i in xrange(5)],
+                       'search': {'href': index_uri + 'search{?q}',
+                                  'templated': True}}
+        register_hal(index_uri, index_links)
+        for i in xrange(5):
+            register_hal(index_uri + 'items/' + str(i),
+                         state={'id': i},
+                         status=500 if i == 2 else 200)
+
+        N = HN.HALNavigator(index_uri)
+        items = N['item']
+        results = HN.HALNavigator.fetch_many(
+            items + [items[0], N['search']], max_workers=2)
+        assert len(results) == 7
+        assert isinstance(results[6], HN.HALNavigatorError)
+        assert results[6].status is None
+        assert results[2].nav is items[2]
+        assert isinstance(results[2], HN.HALNavigatorError)
+        assert results[2].status == 500
+        for i in (0, 1, 3, 4):
+            assert results[i] is items[i]
+            assert items[i].state['id'] == i
+        assert results[5] is items[0]
+
+
+def test_HALNavigator__clones_share_api_context():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'about': {'href': index_uri + 'about'}})
+
+        N = HN.HALNavigator(index_uri, apiname='ex', curie='xx')
+        about = N['about']
+        assert about._api is N._api
+        assert not hasattr(about, '__dict__')
+        assert about.session is N.session
+        assert (about.root, about.apiname, about.default_curie) == \
+            (index_uri, 'ex', 'xx')
+        assert N._api.id_map[about.uri] is about
+
+
+@pytest.mark.skipif(HN.utils.ijson is None, reason='ijson is not installed')
+def test_HALNavigator__stream(monkeypatch):
+    closed = []
+    response_close = requests.Response.close
+    monkeypatch.setattr(requests.Response, 'close', lambda self: (
+        closed.append(self.url), response_close(self)))
+    with httprettify() as HTTPretty:
+        index_uri = 'http://www.example.com/'
+        state = {'items': [{'id': i, 'price': i + 0.5, 'name': u'n\xe9'}
+                           for i in xrange(2000)]}
+        register_hal(index_uri, {'next': {'href': index_uri + 'next'}},
+                     state=state)
+        HTTPretty.register_uri('GET', index_uri + 'next', body='not json')
+
+        N = HN.HALNavigator(index_uri, stream=True)
+        assert N() == state
+        assert isinstance(N.state['items'][3]['price'], float)
+        assert N['next'].uri == index_uri + 'next'
+        with pytest.raises(HN.UnexpectedlyNotJSON):
+            N['next'].fetch()
+        assert closed == [index_uri + 'next']
+
+
+@pytest.mark.skipif(HN.utils.ijson is None, reason='ijson is not installed')
+def test_HALNavigator__stream_counts_chunked_bodies(monkeypatch):
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, state={'items': range(1000)})
+        N = HN.HALNavigator(index_uri, stream=True, retain_bytes=10 ** 6)
+        session_get = N.session.get
+
+        def get(*args, **kwargs):
+            response = session_get(*args, **kwargs)
+            del response.headers['Content-Length']  # as if it was chunked
+            return response
+        monkeypatch.setattr(N.session, 'get', get)
+
+        N.fetch()
+        assert N._api.retained.weight == N.metrics.bytes_received > 2000
+
+
+def test_HALNavigator__json_codec():
+    calls = []
+
+    class Codec(object):
+        @staticmethod
+        def loads(s):
+            calls.append('loads')
+            return json.loads(s)
+
+        @staticmethod
+        def dumps(obj):
+            calls.append('dumps')
+            return json.dumps(obj, separators=(',', ':'))
+
+    with httprettify() as HTTPretty:
+        index_uri = 'http://www.example.com/'
+        hosts_uri = index_uri + 'hosts'
+        register_hal(index_uri, {'hosts': {'href': hosts_uri}})
+        HTTPretty.register_uri('POST', uri=hosts_uri, status=201,
+                               location=index_uri)
+
+        N = HN.HALNavigator(index_uri, json_codec=Codec)
+        N['hosts'].create({'name': 'foo'})
+        assert calls == ['loads', 'dumps']
+        assert HTTPretty.last_request.body == '{"name":"foo"}'
+
+        N = HN.HALNavigator(index_uri, json_codec='no_such_json_module')
+        assert N._api.json.module is json
+        assert N['hosts'].uri == hosts_uri
+
+
+def test_HALNavigator__repr_cache_follows_uri():
+    N = HN.HALNavigator('http://www.example.com/api/', apiname='ex')
+    assert repr(N) == 'HALNavigator(ex)'
+    N.uri = 'http://www.example.com/api/users/42'
+    assert repr(N) == 'HALNavigator(ex.users[42])'
+    N.uri = None
+    N.template_uri = 'http://www.example.com/api/users/{id}'
+    assert repr(N) == 'HALNavigator(ex.users.{id})'
+
+
+@pytest.mark.parametrize('validator_header', ['ETag', 'Last-Modified'])
+def test_HALNavigator__conditional_get(validator_header):
+    with httprettify() as HTTPretty:
+        index_uri = 'http://www.example.com/'
+        server = {'version': '1'}
+        conditional_headers = {'ETag': 'if-none-match',
+                               'Last-Modified': 'if-modified-since'}
+
+        def callback(request, uri, headers):
+            validator = server['version']
+            if validator_header == 'Last-Modified':
+                validator = 'Sat, 0{} Jan 2000 00:00:00 GMT'.format(validator)
+            resp_headers = {validator_header: validator,
+                            'content_type': 'application/hal+json',
+                            'server': 'HTTPretty 0.6.0'}
+            sent = request.headers.get(conditional_headers[validator_header])
+            if sent == validator:
+                return 304, resp_headers, ''
+            body = {'version': server['version'],
+                    '_links': {'self': {'href': uri},
+                               'next': {'href': uri + 'next'}}}
+            return 200, resp_headers, json.dumps(body)
+
+        HTTPretty.register_uri('GET', index_uri, body=callback)
+
+        N = HN.HALNavigator(index_uri)
+        assert N.fetch() == {'version': '1'}
+        links = N._links
+        assert N.refresh() is False
+        assert N.get() == {'version': '1'}
+        assert N._links is links
+        assert N.status == (200, 'OK')
+        server['version'] = '2'
+        assert N.refresh() is True
+        assert N.state == {'version': '2'}
+        assert N._links is not links
+
+
+def test_HALNavigator__retain():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        uris = [index_uri + 'item/{}'.format(i) for i in range(3)]
+        register_hal(index_uri, {'item': {'href': index_uri + 'item/{id}',
+                                          'templated': True}})
+        for uri in uris:
+            register_hal(uri, {'self': {'href': uri}}, state={'uri': uri})
+
+        N = HN.HALNavigator(index_uri, retain=2)
+        for i in range(3):
+            N['item'].expand(id=i).fetch()  # expanded navigators aren't linked
+        gc.collect()
+        id_map = N._api.id_map
+        assert uris[0] not in id_map
+        assert [id_map[uri].state for uri in uris[1:]] == \
+            [{'uri': uri} for uri in uris[1:]]
+
+
+def test_HALNavigator__retain_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(HN.utils.time, 'time', lambda: now[0])
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        item_uri = index_uri + 'item/0'
+        register_hal(index_uri, {'item': {'href': index_uri + 'item/{id}',
+                                          'templated': True}})
+        register_hal(item_uri, state={'id': 0})
+
+        register_hal(index_uri + 'item/1', state={'id': 1})
+
+        N = HN.HALNavigator(index_uri, retain=5, retain_ttl=10)
+        item = N['item'].expand(id=0)
+        item.fetch()
+        now[0] += 11
+        N['item'].expand(id=1).fetch()  # sweeps the expired item
+        assert item.uri not in N._api.retained
+        # still usable by whoever holds it, but fetched again when used
+        assert item.state == {'id': 0} and item._links is not None
+        assert N['item'].expand(id=0) is item
+        requests_made = len(httpretty.httpretty.latest_requests)
+        assert item() == {'id': 0}
+        assert len(httpretty.httpretty.latest_requests) == requests_made + 1
+        assert httpretty.httpretty.last_request.path == '/item/0'
+        item()
+        assert len(httpretty.httpretty.latest_requests) == requests_made + 1
+        with pytest.raises(ValueError):
+            HN.HALNavigator(index_uri, retain_ttl=10)
+
+
+def test_HALNavigator__connection_pools():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'self': {'href': index_uri}})
+        N = HN.HALNavigator(index_uri, cache=True, max_workers=16,
+                            pool_connections=3, keep_alive=False)
+        adapter = N.session.get_adapter(index_uri)
+        assert isinstance(adapter, HN.cachecontrol.CacheControlAdapter)
+        assert (adapter._pool_connections, adapter._pool_maxsize) == (3, 16)
+        assert N.session.headers['Connection'] == 'close'
+        assert N.warm_up(20) == 16
+        pool = adapter.poolmanager.connection_from_url(index_uri)
+        assert all(conn is not None for conn in pool.pool.queue)
+        assert N.fetch() is not None
+
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=50))
+        N = HN.HALNavigator(index_uri, session=session)
+        assert session.get_adapter(index_uri)._pool_maxsize == 50
+
+
+def test_HALNavigator__retry(monkeypatch):
+    delays = []
+    monkeypatch.setattr(HN.utils.time, 'sleep', delays.append)
+    with httprettify() as HTTPretty:
+        index_uri = 'http://www.example.com/'
+        calls = collections.Counter()
+
+        def callback(request, uri, headers):
+            calls[request.method] += 1
+            headers = {'server': 'HTTPretty 0.6.0',
+                       'content_type': 'application/hal+json'}
+            if calls[request.method] < 3:
+                return 503, dict(headers, **{'Retry-After': '2'}), ''
+            return 200, headers, json.dumps({'_links': {}, 'ok': True})
+
+        HTTPretty.register_uri('GET', index_uri, body=callback)
+        HTTPretty.register_uri('POST', index_uri, body=callback)
+
+        N = HN.HALNavigator(index_uri, retry=3)
+        assert N.fetch() == {'ok': True}
+        assert (calls['GET'], delays) == (3, [2, 2])
+        clone = N.clone_navigator({})
+        assert clone._api.retry is N._api.retry
+        with pytest.raises(HN.HALNavigatorError):
+            clone.create({})  # POST isn't retried
+        assert calls['POST'] == 1
+
+
+def test_HALNavigator__retry_respects_deadline(monkeypatch):
+    delays = []
+    monkeypatch.setattr(HN.utils.time, 'sleep', delays.append)
+    with httprettify() as HTTPretty:
+        index_uri = 'http://www.example.com/'
+        HTTPretty.register_uri('GET', index_uri, responses=[
+            httpretty.Response(body='', status=503, server='HTTPretty',
+                               **{'Retry-After': '20'})])
+        N = HN.HALNavigator(index_uri, retry=3)
+        with N.deadline(1.0):
+            with pytest.raises(HN.HALNavigatorError):
+                N.fetch()
+        assert delays == []
+        assert len(HTTPretty.latest_requests) == 1
+
+
+def test_RetryPolicy__backoff():
+    policy = HN.utils.RetryPolicy(backoff=1, max_backoff=5, jitter=False)
+    assert [policy.delay(attempt) for attempt in range(1, 6)] == \
+        [1, 2, 4, 5, 5]
+    policy.jitter = True
+    assert 0 <= policy.delay(3) <= 4
+
+
+def test_HALNavigator__deadline(monkeypatch):
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'next': {'href': index_uri + 'next'}})
+        register_hal(index_uri + 'next', {})
+        N = HN.HALNavigator(index_uri, timeout=5)
+        timeouts = []
+        session_get = N.session.get
+
+        def get(*args, **kwargs):
+            timeouts.append(kwargs['timeout'])
+            return session_get(*args, **kwargs)
+        monkeypatch.setattr(N.session, 'get', get)
+
+        N.fetch()
+        with N.deadline(2):
+            N['next'].fetch()
+            with N.deadline(10):
+                N.fetch()
+        assert timeouts[0] == 5
+        assert all(0 < t <= 2 for t in timeouts[1:])
+        with pytest.raises(exc.DeadlineExceeded):
+            with N.deadline(0):
+                N.fetch()
+        assert len(timeouts) == 3
+
+
+def test_HALNavigator__deadline_in_background_threads(monkeypatch):
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'next': {'href': index_uri + 'next'}})
+        register_hal(index_uri + 'next', {})
+        N = HN.HALNavigator(index_uri, timeout=5)
+        timeouts = []
+        session_get = N.session.get
+
+        def get(*args, **kwargs):
+            timeouts.append(kwargs['timeout'])
+            return session_get(*args, **kwargs)
+        monkeypatch.setattr(N.session, 'get', get)
+
+        nxt = N['next']  # N is fetched outside of the deadline
+        for run in [lambda: HN.HALNavigator.fetch_many([N, nxt]),
+                    lambda: list(N.clone_navigator({}).iterate(read_ahead=1)),
+                    lambda: list(restnavigator.crawl(N.clone_navigator({})))]:
+            del timeouts[:]
+            with N.deadline(2):
+                run()
+            assert timeouts
+            assert all(0 < t <= 2 for t in timeouts)
+        N.close()
+
+
+def test_HALTraversor__follow_deadline():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'next': {'href': index_uri + 'next'}})
+        register_hal(index_uri + 'next', {})
+        T = HALTraversor(index_uri)
+        assert T.follow('next', deadline=5).uri == index_uri + 'next'
+        T = HALTraversor(index_uri)
+        with pytest.raises(exc.DeadlineExceeded):
+            T.follow('next', deadline=0)
+
+
+def test_HALTraversor__follow_path_cache():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'user': {'href': index_uri + 'users/{name}',
+                                          'templated': True}})
+        register_hal(index_uri + 'users/fred', {'posts': {'href': index_uri + 'posts'}})
+        register_hal(index_uri + 'posts', {})
+        T = HALTraversor(index_uri, path_cache=True)
+        T.with_template_parameters(name='fred')
+        posts = T.follow('user', 'posts')
+        requests_made = len(httpretty.httpretty.latest_requests)
+        T.navigator = T.navigator.clone_navigator({})
+        assert T.follow('user', 'posts') is posts
+        assert len(httpretty.httpretty.latest_requests) == requests_made
+
+
+@pytest.mark.parametrize('cache_control, cached', [
+    (None, True),
+    ('max-age=300', True),
+    ('no-cache', False),
+])
+def test_HALNavigator__path_cache(cache_control, cached):
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        headers = {'cache-control': cache_control} if cache_control else None
+        register_hal(index_uri, {'me': {'href': index_uri + 'me'}},
+                     headers=headers)
+        register_hal(index_uri + 'me', {'posts': {'href': index_uri + 'posts'}},
+                     headers=headers)
+        register_hal(index_uri + 'posts', {})
+
+        N = HN.HALNavigator(index_uri, path_cache=True)
+        posts = N['me', 'posts']
+        assert posts.uri == index_uri + 'posts'
+        requests_made = len(httpretty.httpretty.latest_requests)
+        start = N.clone_navigator({})  # same uri, nothing fetched yet
+        assert start['me', 'posts'] is posts
+        assert len(httpretty.httpretty.latest_requests) == \
+            requests_made + (0 if cached else 1)
+
+
+def test_freshness_lifetime():
+    response = requests.Response()
+    response.status_code = 200
+    response.headers['Cache-Control'] = 'public, max-age=100'
+    response.headers['Age'] = '40'
+    assert HN.utils.freshness_lifetime(response, 5) == 60
+    del response.headers['Cache-Control']
+    assert HN.utils.freshness_lifetime(response, 5) == 5
+    response.headers['Date'] = 'Sat, 01 Jan 2000 00:00:00 GMT'
+    response.headers['Expires'] = 'Sat, 01 Jan 2000 00:01:40 GMT'
+    assert HN.utils.freshness_lifetime(response, 5) == 60
+    response.status_code = 500
+    assert HN.utils.freshness_lifetime(response, 5) == 0
+
+
+def test_HALTraversor__follow_fan_out():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        post_uris = [index_uri + 'posts/{}'.format(i) for i in range(4)]
+        register_hal(index_uri, {'post': [{'href': uri} for uri in post_uris]})
+        for i, uri in enumerate(post_uris):
+            register_hal(uri, {'author': {'href': index_uri + 'users/{}'.format(i % 2)}})
+        T = HALTraversor(index_uri, max_workers=3)
+        authors = T.follow('post', 'author')
+        assert [author.uri for author in authors] == \
+            [index_uri + 'users/{}'.format(i % 2) for i in range(4)]
+        assert all(nav.state is not None for nav in T.navigator['post'])
+
+
+def test_crawl():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {
+            'users': {'href': index_uri + 'users'},
+            'search': {'href': index_uri + 'search{?q}', 'templated': True},
+            'about': {'href': index_uri + 'about'},
+        })
+        register_hal(index_uri + 'users', {
+            'user': [{'href': index_uri + 'users/{}'.format(i)} for i in range(3)],
+            'index': {'href': index_uri},
+        })
+        for i in range(3):
+            register_hal(index_uri + 'users/{}'.format(i),
+                         {'friend': {'href': index_uri + 'users/0'}})
+        register_hal(index_uri + 'search?q=x', {})
+
+        uris = lambda navs: sorted(nav.uri for nav in navs)
+        visited = list(restnavigator.crawl(index_uri, workers=3,
+                                           rel_filter=lambda rel: rel != 'about'))
+        assert uris(visited) == [index_uri, index_uri + 'users'] + \
+            [index_uri + 'users/{}'.format(i) for i in range(3)]
+        visited = list(restnavigator.crawl(index_uri, max_depth=1,
+                                           template_args={'q': 'x'}))
+        assert uris(visited) == [index_uri, index_uri + 'about',
+                                 index_uri + 'search?q=x', index_uri + 'users']
+        assert len(list(restnavigator.crawl(index_uri, max_requests=2))) == 2
+
+
+def test_crawl__uses_the_api_worker_pool(monkeypatch):
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'item': [
+            {'href': index_uri + 'items/{}'.format(i)} for i in range(6)]})
+        for i in range(6):
+            register_hal(index_uri + 'items/{}'.format(i), {})
+        N = HN.HALNavigator(index_uri, max_workers=2)
+        N.fetch()
+        lock = threading.Lock()
+        active = [0, 0]  # now, most at once
+        session_get = N.session.get
+
+        def get(*args, **kwargs):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.02)
+            try:
+                return session_get(*args, **kwargs)
+            finally:
+                with lock:
+                    active[0] -= 1
+        monkeypatch.setattr(N.session, 'get', get)
+
+        assert len(list(restnavigator.crawl(N, workers=10))) == 7
+        assert active[1] <= 2
+        N.close()
+
+
+def test_HALNavigator__hooks():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'next': {'href': index_uri + 'next'},
+                                 'missing': {'href': index_uri + 'missing'}})
+        register_hal(index_uri + 'next', {'prev': {'href': index_uri}})
+        register_hal(index_uri + 'missing', {}, status=404)
+        events = []
+
+        def record(event):
+            events.append((event.name, event.uri, event.method, event.rel,
+                           event.status))
+        N = HN.HALNavigator(index_uri, hooks={
+            'before_request': record, 'after_parse': [record]})
+        for name in ('after_response', 'on_error', 'on_identity_map_hit'):
+            N.add_hook(name, record)
+        timings = []
+        N.add_hook('after_parse', lambda event: timings.append(
+            (event.bytes, event.network_time, event.parse_time)))
+
+        N['next']['prev']
+        N.clone_navigator({})['missing'].fetch(raise_exc=False)
+        assert events == [
+            ('before_request', index_uri, 'GET', None, None),
+            ('after_response', index_uri, 'GET', None, 200),
+            ('after_parse', index_uri, 'GET', None, 200),
+            ('before_request', index_uri + 'next', 'GET', 'next', None),
+            ('after_response', index_uri + 'next', 'GET', 'next', 200),
+            ('after_parse', index_uri + 'next', 'GET', 'next', 200),
+            ('on_identity_map_hit', index_uri, None, None, None),
+            ('before_request', index_uri, 'GET', None, None),
+            ('after_response', index_uri, 'GET', None, 200),
+            ('after_parse', index_uri, 'GET', None, 200),
+        ] + events[10:12] + [
+            ('before_request', index_uri + 'missing', 'GET', 'missing', None),
+            ('after_response', index_uri + 'missing', 'GET', 'missing', 404),
+            ('on_error', index_uri + 'missing', 'GET', 'missing', 404),
+            ('after_parse', index_uri + 'missing', 'GET', 'missing', 404),
+        ]
+        # the clone's links are built together, and N still holds them all
+        assert sorted(events[10:12]) == [
+            ('on_identity_map_hit', index_uri + 'missing', None, 'missing',
+             None),
+            ('on_identity_map_hit', index_uri + 'next', None, 'next', None),
+        ]
+        assert all(size > 0 and network >= 0 and parse >= 0
+                   for size, network, parse in timings)
+        with pytest.raises(ValueError):
+            N.add_hook('before_everything', record)
+
+
+def test_HALNavigator__metrics():
+    with httprettify():
+        index_uri = 'http://www.example.com/'
+        register_hal(index_uri, {'next': {'href': index_uri + 'next'},
+                                 'self_again': {'href': index_uri}},
+                     headers={'cache-control': 'max-age=300',
+                              'date': 'Sat, 01 Jan 2000 00:00:00 GMT'})
+        register_hal(index_uri + 'next', {}, status=404)
+        N = HN.HALNavigator(index_uri, cache=True)
+        N['self_again']
+        N['next'].fetch(raise_exc=False)
+        N.clone_navigator({}).fetch()  # answered by the http cache
+        assert N.clone_navigator({}).metrics is N.metrics
+        metrics = N.metrics.reset()
+        d = metrics.as_dict()
+        assert d['requests'] == {'GET 200': 2, 'GET 404': 1}
+        assert d['total_requests'] == 3
+        assert (d['cache_hits'], d['revalidations'], d['errors']) == (1, 0, 0)
+        assert d['network_requests'] == 2
+        assert (d['id_map_hits'], d['id_map_misses']) == (1, 1)
+        assert d['autofetches'] == 1
+        assert d['bytes_received'] > 0 and d['parse_time'] > 0
+        assert N.metrics.as_dict()['total_requests'] == 0
+
+
+def test_HALNavigator__metrics_cache_hits_and_revalidations():
+    with httprettify() as HTTPretty:
+        index_uri = 'http://www.example.com/'
+
+        def callback(request, uri, headers):
+            max_age = 0 if uri.endswith('stale') else 300
+            resp_headers = {'ETag': 'v1',
+                            'cache-control': 'max-age={}'.format(max_age),
+                            'date': time.strftime('%a, %d %b %Y %H:%M:%S GMT',
+                                                  time.gmtime()),
+                            'content_type': 'application/hal+json',
+                            'server': 'HTTPretty 0.6.0'}
+            if request.headers.get('if-none-match') == 'v1':
+                return 304, resp_headers, ''
+            body = {'_links': {'stale': {'href': index_uri + 'stale'}}}
+            return 200, resp_headers, json.dumps(body)
+        HTTPretty.register_uri('GET', index_uri, body=callback)
+        HTTPretty.register_uri('GET', index_uri + 'stale', body=callback)
+
+        N = HN.HALNavigator(index_uri, cache=True)
+        stale = N['stale']
+        stale.fetch()
+        network_bytes = N.metrics.bytes_received
+        N.refresh()  # sends validators, but is answered by the cache
+        stale.clone_navigator({}).fetch()  # the server answers with a 304
+        d = N.metrics.as_dict()
+        assert d['total_requests'] == 4
+        assert (d['network_requests'], d['cache_hits']) == (3, 1)
+        assert d['revalidations'] == 1
+        assert d['bytes_received'] == network_bytes > 0
+        assert d['cache_bytes'] > 0
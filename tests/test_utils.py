@@ -168,7 +168,7 @@ def test_LinkList__init_iterator(linklist):
     ll_ctor = RNU.LinkList(ctor_arg)
     assert ll_iterated == ll_ctor
     # Non black-box test warning!
-    assert ll_iterated._meta == ll_ctor._meta
+    assert ll_iterated._columns == ll_ctor._columns
 
 
 @pytest.fixture
@@ -208,3 +208,149 @@ def test_LinkList__get_by_unicode_valu():
     prop_list = [('VALUE', {'title': unicode_value})]
     test_list = RNU.LinkList(prop_list)
     assert test_list.get_by('title', unicode_value) == 'VALUE'
+
+
+@pytest.mark.parametrize(('content', 'content_type', 'expected'), [
+    (b'{"a": "\xc3\xa9"}', 'application/hal+json', b'{"a": "\xc3\xa9"}'),
+    (b'{"a": "\xc3\xa9"}', 'application/json; charset=UTF-8',
+     b'{"a": "\xc3\xa9"}'),
+    (b'\xef\xbb\xbf{}', None, b'{}'),
+    (b'{"a": "\xe9"}', 'application/json; charset=iso-8859-1',
+     u'{"a": "\xe9"}'),
+])
+def test_json_body(content, content_type, expected):
+    body = RNU.json_body(content, content_type)
+    assert body == expected
+    assert type(body) == type(expected)
+
+
+@pytest.mark.parametrize('template', [
+    'http://example.com/users/{name}',
+    'http://example.com/{?max,page}',
+    'http://{.domain*}{/a,b}{?q,r}',
+    'http://example.com/{+path}/here{#frag}{;x,y}{&z}',
+    'http://example.com/{x=dflt}/{name:3}/{list*}',
+    'http://example.com/no/variables',
+])
+def test_CompiledTemplate__expands_like_uritemplate(template):
+    import uritemplate
+    compiled = RNU.CompiledTemplate(template)
+    assert compiled.variables == uritemplate.variables(template)
+    for variables in [
+            {},
+            {'name': 'fred23', 'max': 4, 'page': '0', 'x': ''},
+            {'domain': ['a', 'b'], 'a': 'x/y', 'q': 'a b', 'r': None},
+            {'path': 'a/b', 'frag': 'f', 'x': 1, 'y': '', 'z': [1, 2]},
+            {'list': ['a', 'b'], 'name': 'abcdef', 'x': None},
+    ]:
+        assert compiled.expand(variables) == \
+            uritemplate.expand(template, variables)
+
+
+def test_CompiledTemplate__falls_back_to_uritemplate(monkeypatch):
+    import uritemplate
+    monkeypatch.setattr(RNU, '_URITEMPLATE_INTERNALS', False)
+    template = 'http://example.com/{x=dflt}/{name:3}/{list*}'
+    compiled = RNU.CompiledTemplate(template)
+    variables = {'list': ['a', 'b'], 'name': 'abcdef'}
+    assert compiled.expand(variables) == \
+        uritemplate.expand(template, variables)
+
+
+@pytest.mark.parametrize('template', ['/s{|x}', '/p{x:ab}'])
+def test_CompiledTemplate__errors_on_expand(template):
+    compiled = RNU.CompiledTemplate(template)
+    assert compiled.variables == set(['x'])
+    with pytest.raises((KeyError, ValueError)):
+        compiled.expand({'x': 'y'})
+
+
+def test_LRUCache():
+    cache = RNU.LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    cache['c'] = 3
+    assert 'b' not in cache
+    assert cache.get('b', 'missing') == 'missing'
+    assert (cache.get('a'), cache.get('c'), len(cache)) == (1, 3, 2)
+
+
+def test_LRUCache__weight_and_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(RNU.time, 'time', lambda: now[0])
+    cache = RNU.LRUCache(max_weight=10, ttl=60)
+    cache.set('a', 1, weight=6)
+    cache.set('b', 2, weight=3)
+    cache.set('c', 3, weight=4)
+    assert 'a' not in cache
+    assert cache.weight == 7
+    cache.set('huge', 4, weight=11)
+    assert 'huge' not in cache
+    now[0] += 61
+    assert cache.get('b', 'expired') == 'expired'
+    assert len(cache) == 1
+
+
+def test_LRUCache__sweeps_expired_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(RNU.time, 'time', lambda: now[0])
+    expired = []
+    cache = RNU.LRUCache(ttl=10, on_expire=expired.append)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    now[0] += 11
+    cache.set('b', 3)  # replacing doesn't count as expiring
+    assert (expired, 'a' in cache, cache.get('b')) == ([1], False, 3)
+
+
+def test_namify__memoized():
+    uri = 'http://www.example.com/memoized/api'
+    assert RNU.namify(uri) == RNU.namify.uncached(uri) == 'ExampleMemoizedAPI'
+    assert uri in RNU.namify.cache
+
+
+def test_LinkDict__resolution_index():
+    ld = RNU.LinkDict('xx', {
+        'xx:foo': 1,
+        'yy:bar': 2,
+        'yy:baz': 3, 'zz:baz': 4,
+        'next': 5, 'xx:next': 6,
+        'xx:prev': 7,
+        'plain': 8,
+        'http://example.com/rels/qux': 9,
+    }, curies=['xx', 'yy', 'zz'])
+    assert ld['foo'] == ld['xx:foo'] == 1
+    assert ld['bar'] == 2
+    assert ld['next'] == 5
+    assert ld['prev'] == 7
+    assert ld['plain'] == 8
+    assert ld['http://example.com/rels/qux'] == 9
+    with pytest.raises(KeyError):
+        ld['baz']  # both yy and zz have one
+    assert ld.resolve('foo') == 'xx:foo'
+    assert ld.resolve('unknown') == 'unknown'
+    assert ld.resolutions['bar'] == 'yy:bar'
+    ld['zz:new'] = 10
+    assert ld['new'] == 10
+
+
+def test_LinkList__index_is_built_lazily(linklist):
+    ll, objs = linklist
+    assert ll._indexes == {}
+    assert ll.get_by('klass', 'B') == objs['B.a']
+    assert ll._indexes.keys() == ['klass']
+    late = object()
+    ll.append_with(late, klass='B')
+    assert ll.getall_by('klass', 'B') == [objs['B.a'], late]
+
+
+def test_LinkList__filter(linklist):
+    ll, objs = linklist
+    assert ll.filter(klass='A', id='b') == [objs['A.b']]
+    assert ll.filter(id='a', klass=lambda k: k in 'BC') == \
+        [objs['B.a'], objs['C.a']]
+    assert ll.filter(name=lambda n: n.endswith('.b')) == [objs['A.b']]
+    assert ll.filter(klass='A', id='c') == []
+    assert ll.filter(nonexistent=lambda v: True) == []
+    assert ll.filter() == list(objs.values())